@@ -0,0 +1,108 @@
+import asyncio
+
+import paho.mqtt.client as mqtt
+
+from MQTTClient import reconnect_delay
+
+# Keepalive pings, retries and timeouts are driven from here [s]
+MISC_INTERVAL = 1.0
+
+
+class AsyncioTransport:
+    """Runs the paho network loop on the asyncio event loop Kivy runs on.
+
+    Instead of paho's own thread, the socket is watched with add_reader /
+    add_writer, so receiving, decoding and the topic callbacks all happen on
+    the UI thread. Needs the app to be started with async_run(async_lib="asyncio").
+    """
+
+    def __init__(self, mqtt_client):
+        self.mqtt_client = mqtt_client
+        self.client = mqtt_client.client
+        self.loop = None
+        self.task = None
+        self.disconnected = None
+        self.client.on_socket_open = self.on_socket_open
+        self.client.on_socket_close = self.on_socket_close
+        self.client.on_socket_register_write = self.on_socket_register_write
+        self.client.on_socket_unregister_write = self.on_socket_unregister_write
+
+    # The socket callbacks can come from the connect executor thread, the
+    # loop is only touched through call_soon_threadsafe
+    def on_socket_open(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.add_reader, sock, client.loop_read)
+
+    def on_socket_close(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self._socket_closed, sock)
+
+    def on_socket_register_write(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.add_writer, sock, client.loop_write)
+
+    def on_socket_unregister_write(self, client, userdata, sock):
+        self.loop.call_soon_threadsafe(self.loop.remove_writer, sock)
+
+    def _socket_closed(self, sock):
+        self.loop.remove_reader(sock)
+        self.loop.remove_writer(sock)
+        if self.disconnected is not None:
+            self.disconnected.set()
+
+    def connect(self, broker, port):
+        # Called from the UI, i.e. from inside the running loop
+        self.loop = asyncio.get_running_loop()
+        if self.task is not None:
+            self.task.cancel()
+        self.task = self.loop.create_task(self._run(broker, port, self.task))
+        return True
+
+    def disconnect(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+        try:
+            self.client.disconnect()
+        except Exception:
+            pass
+
+    async def _run(self, broker, port, previous_task):
+        if previous_task is not None:
+            try:
+                await previous_task
+            except asyncio.CancelledError:
+                pass
+
+        mqtt_client = self.mqtt_client
+        mqtt_client.reconnect_attempt = 0
+        try:
+            while True:
+                mqtt_client.set_status(f"Connecting to {broker}:{port}...", "orange")
+                self.disconnected = asyncio.Event()
+                try:
+                    # DNS and the TCP handshake block, keep them off the UI thread
+                    await self.loop.run_in_executor(None, self.client.connect, broker, port, 60)
+                    await self._serve()
+                except (OSError, ValueError) as e:
+                    print(f"Connection failed: {e}")
+
+                mqtt_client.subscribed_topics.clear()
+                delay = reconnect_delay(mqtt_client.reconnect_attempt)
+                mqtt_client.reconnect_attempt += 1
+                mqtt_client.set_status(f"Disconnected, retrying in {delay:.0f}s", "red")
+                await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            try:
+                self.client.disconnect()
+            except Exception:
+                pass
+            mqtt_client.subscribed_topics.clear()
+            mqtt_client.set_status("Disconnected", "red")
+            raise
+
+    async def _serve(self):
+        while not self.disconnected.is_set():
+            if self.client.loop_misc() != mqtt.MQTT_ERR_SUCCESS:
+                return
+            try:
+                await asyncio.wait_for(self.disconnected.wait(), MISC_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
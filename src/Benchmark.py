@@ -0,0 +1,267 @@
+"""Headless end-to-end latency benchmark: MQTT payload -> widget update.
+
+Runs MainApp with a hidden window against a LocalBroker and measures, per topic,
+the time from MQTTClient.on_message until the state store and the widgets
+subscribed to it have been updated.
+
+    cd src && python Benchmark.py --rate 50 --size 64 --duration 5 --output bench_results.json
+
+On machines without a display run it under xvfb-run.
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+os.environ.setdefault("KIVY_NO_ARGS", "1")
+os.environ.setdefault("KIVY_NO_CONSOLELOG", "1")
+
+from kivy.config import Config
+
+Config.set("graphics", "window_state", "hidden")
+
+from kivy.clock import Clock
+
+from HistoryStore import HistoryStore
+from LocalBroker import LocalBroker, LocalClient
+from main import MainApp
+from MQTTClient import MQTTClient
+from SnapshotCache import SnapshotCache
+
+BENCH_TOPICS = ("RELAYS", "SENSORS", "CMD_LIST")
+# Screen shown while a topic is benchmarked, hidden screens defer their updates
+BENCH_SCREENS = {"RELAYS": "relay", "SENSORS": "sensors", "CMD_LIST": "commands"}
+STATES = ("Opened", "Closed")
+PRIORITIES = ("PLW", "P00", "P01", "P02", "P03", "P04", "P05", "P06", "P07", "P08", "P09", "PHI")
+
+
+def make_relays(size, rng):
+    return {
+        f"R{i:02d}": {
+            "state": rng.choice(STATES),
+            "cmd": f"Manua;R{i:02d};{rng.choice(STATES)};P00;",
+            "priority": rng.choice(PRIORITIES),
+        }
+        for i in range(1, size + 1)
+    }
+
+
+def make_sensors(size, rng):
+    payload = {f"sensor{i}_C": round(rng.uniform(0, 40), 2) for i in range(size)}
+    payload["soilMoisture"] = [round(rng.uniform(0, 100), 1) for _ in range(8)]
+    payload["valid"] = True
+    return payload
+
+
+def make_cmd_list(size, rng):
+    return {
+        "cmdList": [
+            f"ATime;R{rng.randint(1, 16):02d};{rng.choice(STATES)};{rng.choice(PRIORITIES)};{i};"
+            for i in range(size)
+        ]
+    }
+
+
+PAYLOAD_FACTORIES = {
+    "RELAYS": make_relays,
+    "SENSORS": make_sensors,
+    "CMD_LIST": make_cmd_list,
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(pct / 100 * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "describe", "--always", "--dirty"], stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except Exception:
+        return None
+
+
+class BenchmarkApp(MainApp):
+    def __init__(self, options, **kwargs):
+        self.options = options
+        self.broker = LocalBroker()
+        # History and snapshot go to a scratch directory, and the run starts cold
+        self.history_dir = tempfile.TemporaryDirectory()
+        mqtt_client = MQTTClient(lambda *args: self.on_connect(*args), LocalClient(self.broker))
+        super().__init__(
+            mqtt_client=mqtt_client,
+            history_store=HistoryStore(self.history_dir.name),
+            snapshot_cache=SnapshotCache(os.path.join(self.history_dir.name, "snapshot.json")),
+            **kwargs
+        )
+        self.connected = threading.Event()
+        self.__lock = threading.Lock()
+        self.__arrival = None
+        self.__arrivals = {}
+        self.latencies = {topic: [] for topic in BENCH_TOPICS}
+        self.results = {}
+
+    def on_connect(self, client, userdata, flags, rc):
+        super().on_connect(client, userdata, flags, rc)
+        self.connected.set()
+
+    def set_callbacks(self):
+        # Time the UI side of each benchmarked topic: the store update including
+        # the widgets subscribed to it
+        widget_handlers = {
+            "RELAYS": (self.store, "apply_relays"),
+            "SENSORS": (self.store, "apply_sensors"),
+            "CMD_LIST": (self.store, "apply_cmd_list"),
+        }
+        for topic_key, (widget, name) in widget_handlers.items():
+            setattr(widget, name, self._timed_handler(topic_key, getattr(widget, name)))
+
+        super().set_callbacks()
+
+        # Stamp the arrival of each parsed payload, on the MQTT thread
+        for topic_key in widget_handlers:
+            topic = self.mqtt_client.SUB_TOPICS[topic_key]
+            self.mqttTopicCallbacks[topic] = self._stamped_callback(topic_key, self.mqttTopicCallbacks[topic])
+        on_message = self.mqtt_client.client.on_message
+
+        def timed_on_message(client, userdata, msg):
+            self.__arrival = time.perf_counter()
+            on_message(client, userdata, msg)
+
+        self.mqtt_client.client.on_message = timed_on_message
+
+    def _stamped_callback(self, topic_key, callback):
+        def stamped(payload):
+            # The mailbox only ever delivers the newest payload of a topic
+            with self.__lock:
+                self.__arrivals[topic_key] = (self.__arrival, payload)
+            callback(payload)
+        return stamped
+
+    def _timed_handler(self, topic_key, handler):
+        def timed(payload):
+            handler(payload)
+            done = time.perf_counter()
+            with self.__lock:
+                arrival = self.__arrivals.get(topic_key)
+                if arrival is not None and arrival[1] is payload:
+                    del self.__arrivals[topic_key]
+                else:
+                    arrival = None
+            if arrival is not None:
+                self.latencies[topic_key].append(done - arrival[0])
+        return timed
+
+    def on_start(self):
+        threading.Thread(target=self._drive, name="BenchmarkDriver", daemon=True).start()
+
+    def _drive(self):
+        options = self.options
+        rng = random.Random(options.seed)
+        self.mqtt_client.connect_to_server("local", 0)
+        self.connected.wait(10)
+
+        for topic_key in options.topics:
+            topic = self.mqtt_client.SUB_TOPICS[topic_key]
+            shown = threading.Event()
+
+            def show_screen(dt, name=BENCH_SCREENS[topic_key]):
+                self.screen_manager.current = name
+                shown.set()
+
+            Clock.schedule_once(show_screen)
+            shown.wait(5)
+            # Payloads are encoded up front so generating them is not measured
+            payloads = [
+                json.dumps(PAYLOAD_FACTORIES[topic_key](options.size, rng))
+                for _ in range(max(1, int(options.rate * options.duration)))
+            ]
+            self.latencies[topic_key].clear()
+            with self.__lock:
+                self.__arrivals.clear()
+            if options.memory:
+                tracemalloc.start()
+                tracemalloc.reset_peak()
+
+            interval = 1.0 / options.rate
+            start = time.perf_counter()
+            for i, payload in enumerate(payloads):
+                delay = start + i * interval - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+                self.broker.publish(topic, payload)
+            sent_elapsed = time.perf_counter() - start
+            time.sleep(options.settle)
+
+            peak_kb = None
+            if options.memory:
+                peak_kb = tracemalloc.get_traced_memory()[1] / 1024
+                tracemalloc.stop()
+
+            latencies = sorted(self.latencies[topic_key])
+            self.results[topic_key] = {
+                "sent": len(payloads),
+                "updated": len(latencies),
+                "coalesced": len(payloads) - len(latencies),
+                "p50_ms": self._ms(percentile(latencies, 50)),
+                "p95_ms": self._ms(percentile(latencies, 95)),
+                "p99_ms": self._ms(percentile(latencies, 99)),
+                "max_ms": self._ms(latencies[-1] if latencies else None),
+                "sent_per_s": len(payloads) / sent_elapsed if sent_elapsed else None,
+                "updates_per_s": len(latencies) / (sent_elapsed + options.settle),
+                "peak_memory_kb": peak_kb,
+            }
+            print(f"{topic_key}: {self.results[topic_key]}")
+
+        Clock.schedule_once(lambda dt: self.stop())
+
+    def _ms(self, seconds):
+        return None if seconds is None else round(seconds * 1000, 3)
+
+    def on_stop(self):
+        super().on_stop()
+        self.history_dir.cleanup()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Message to widget latency benchmark")
+    parser.add_argument("--topics", nargs="+", default=list(BENCH_TOPICS), choices=BENCH_TOPICS)
+    parser.add_argument("--rate", type=float, default=50, help="messages per second per topic")
+    parser.add_argument("--size", type=int, default=16, help="relays / sensors / commands per payload")
+    parser.add_argument("--duration", type=float, default=5, help="seconds per topic")
+    parser.add_argument("--settle", type=float, default=1, help="seconds to wait after the last message")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="skip tracemalloc peak memory tracking")
+    parser.add_argument("--output", default="bench_results.json")
+    options = parser.parse_args(argv)
+
+    app = BenchmarkApp(options)
+    app.run()
+
+    report = {
+        "timestamp": time.time(),
+        "revision": git_revision(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "options": {k: v for k, v in vars(options).items() if k != "output"},
+        "results": app.results,
+    }
+    with open(options.output, "w") as f:
+        json.dump(report, f, indent=4)
+    print(f"Results written to {options.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,209 @@
+from collections import Counter
+
+from SchedulePreview import MINUTES_PER_DAY, SENSOR_TYPES, time_window
+
+START_CHAR = "startChar"
+END_CHAR = "endChar"
+SEPARATOR = ";"
+
+# CMD_OPTIONS keys of the fields every command starts with
+TYPE_KEY = "CommandType"
+RELAY_KEY = "RelayIds"
+STATE_KEY = "RelayState"
+PRIORITY_KEY = "CmdPriority"
+ALL_RELAYS = "RXX"
+# Priorities of overrides (toggles), they are not offered in CMD_OPTIONS
+OVERRIDE_PRIORITIES = ("PTO", "PTX")
+
+
+class CommandSyntaxError(ValueError):
+    pass
+
+
+class ParsedCommand:
+    __slots__ = ("raw", "type", "relay", "state", "priority", "description")
+
+    def __init__(self, raw, type, relay, state, priority, description):
+        self.raw = raw
+        self.type = type
+        self.relay = relay
+        self.state = state
+        self.priority = priority
+        self.description = description
+
+    def __repr__(self):
+        return f"ParsedCommand({self.raw!r})"
+
+
+class CommandGrammar:
+    """Command syntax compiled from a CMD_OPTIONS payload.
+
+    A command is startChar, the option fields in CMD_OPTIONS order and a free
+    text description, separated by ';', then endChar.
+    """
+
+    def __init__(self, command_options):
+        self.command_options = command_options
+        self.start = command_options.get(START_CHAR, "")
+        self.end = command_options.get(END_CHAR, "")
+        self.fields = [
+            (key, frozenset(values))
+            for key, values in command_options.items()
+            if key not in (START_CHAR, END_CHAR)
+        ]
+        self.field_index = {key: i for i, (key, _) in enumerate(self.fields)}
+        missing = [key for key in (TYPE_KEY, RELAY_KEY, STATE_KEY, PRIORITY_KEY) if key not in self.field_index]
+        if missing:
+            raise CommandSyntaxError(f"command options without {', '.join(missing)}")
+
+    def build(self, values, description=""):
+        # values: CMD_OPTIONS key -> selected value
+        fields = [values[key] for key, _ in self.fields]
+        return self.start + SEPARATOR.join(fields + [description]) + self.end
+
+    def parse(self, cmd):
+        if not isinstance(cmd, str):
+            raise CommandSyntaxError(f"not a string: {cmd!r}")
+        body = cmd
+        if self.start and body.startswith(self.start):
+            body = body[len(self.start):]
+        if self.end and body.endswith(self.end):
+            body = body[:-len(self.end)]
+        if "\n" in body:
+            raise CommandSyntaxError("multi-line command")
+
+        parts = body.split(SEPARATOR, len(self.fields))
+        if len(parts) < len(self.fields):
+            names = SEPARATOR.join(key for key, _ in self.fields)
+            raise CommandSyntaxError(f"expected {names};description, got {cmd!r}")
+        for (key, allowed), value in zip(self.fields, parts):
+            if value in allowed:
+                continue
+            if key == PRIORITY_KEY and value in OVERRIDE_PRIORITIES:
+                continue
+            raise CommandSyntaxError(f"unknown {key} {value!r}")
+
+        index = self.field_index
+        return ParsedCommand(
+            cmd,
+            parts[index[TYPE_KEY]],
+            parts[index[RELAY_KEY]],
+            parts[index[STATE_KEY]],
+            parts[index[PRIORITY_KEY]],
+            parts[len(self.fields)] if len(parts) > len(self.fields) else "",
+        )
+
+
+def _active_ranges(parsed):
+    # Minute ranges of the day a command applies in, None if it depends on sensors
+    if parsed.type in SENSOR_TYPES:
+        return None
+    window = time_window(parsed.description) if parsed.type == "ATime" else None
+    if window is None:
+        return ((0, MINUTES_PER_DAY),)  # not time bound, or a window the preview cannot tell
+    start, end = window
+    if start < end:
+        return ((start, end),)
+    return ((start, MINUTES_PER_DAY), (0, end))  # past midnight
+
+
+def overlap(parsed, other):
+    """Whether two commands can apply at the same time.
+
+    ATime windows are compared, sensor driven commands are never reported
+    since their overlap depends on the readings.
+    """
+    ranges = _active_ranges(parsed)
+    other_ranges = _active_ranges(other)
+    if ranges is None or other_ranges is None:
+        return False
+    return any(start < other_end and other_start < end
+               for start, end in ranges for other_start, other_end in other_ranges)
+
+
+_compiled = (None, None)
+
+
+def compile_grammar(command_options):
+    # The same CMD_OPTIONS payload is compiled once, whoever asks first
+    global _compiled
+    options, grammar = _compiled
+    if options is not command_options:
+        grammar = CommandGrammar(command_options)
+        _compiled = (command_options, grammar)
+    return grammar
+
+
+class ConflictIndex:
+    """Parsed command list indexed by relay and priority, and by command type.
+
+    Two commands conflict when they drive the same relay (RXX drives all of
+    them) at the same priority to opposite states at overlapping times. The
+    controller still resolves that (the later command wins), so conflicts are
+    warnings, only syntax errors and duplicates are refused.
+    """
+
+    def __init__(self, grammar):
+        self.grammar = grammar
+        self.by_relay = {}  # relay -> priority -> [ParsedCommand]
+        self.by_type = {}  # type -> [ParsedCommand]
+        self.unparsed_commands = Counter()
+
+    @property
+    def unparsed(self):
+        return sum(self.unparsed_commands.values())
+
+    def rebuild(self, commands):
+        self.by_relay = {}
+        self.by_type = {}
+        self.unparsed_commands = Counter()
+        for cmd in commands:
+            self.add(cmd)
+
+    def add(self, cmd):
+        try:
+            parsed = self.grammar.parse(cmd)
+        except CommandSyntaxError:
+            self.unparsed_commands[cmd] += 1
+            return None
+        self.by_relay.setdefault(parsed.relay, {}).setdefault(parsed.priority, []).append(parsed)
+        self.by_type.setdefault(parsed.type, []).append(parsed)
+        return parsed
+
+    def remove(self, cmd):
+        try:
+            parsed = self.grammar.parse(cmd)
+        except CommandSyntaxError:
+            if self.unparsed_commands[cmd] > 1:
+                self.unparsed_commands[cmd] -= 1
+            else:
+                self.unparsed_commands.pop(cmd, None)  # also never added
+            return
+        for same in (self.by_relay.get(parsed.relay, {}).get(parsed.priority, []),
+                     self.by_type.get(parsed.type, [])):
+            for i, other in enumerate(same):
+                if other.raw == cmd:
+                    del same[i]
+                    break
+
+    def _candidates(self, relay, priority):
+        relays = self.by_relay if relay == ALL_RELAYS else (relay, ALL_RELAYS)
+        for other_relay in relays:
+            yield from self.by_relay.get(other_relay, {}).get(priority, ())
+
+    def conflicts(self, parsed):
+        return [
+            other for other in self._candidates(parsed.relay, parsed.priority)
+            if other.state != parsed.state and overlap(parsed, other)
+        ]
+
+    def duplicates(self, parsed):
+        return [other for other in self._candidates(parsed.relay, parsed.priority) if other.raw == parsed.raw]
+
+    def check(self, cmd):
+        # Returns the parsed command and its conflicts, raises CommandSyntaxError
+        # for a command that cannot be added
+        parsed = self.grammar.parse(cmd)
+        if self.duplicates(parsed):
+            raise CommandSyntaxError(f"{cmd} is already in the list")
+        return parsed, self.conflicts(parsed)
@@ -0,0 +1,233 @@
+import codecs
+import json
+import os
+import re
+import threading
+
+from CommandGrammar import CommandSyntaxError, compile_grammar
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+READ_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_BYTES = 4096  # one IMPORT_FROM_FILE message
+MAX_CHUNK_COMMANDS = 64
+ACK_TIMEOUT = 10.0  # wait for the controller's CMD_RESPONSE to a chunk [s]
+IMPORT_ACTION = "IMPORT_FROM_FILE"
+OK_RESULTS = ("OK", "ok", True)
+
+CMD_LIST_START = re.compile(r'"cmdList"\s*:\s*\[')
+WHITESPACE = " \t\r\n"
+
+
+class CommandImportError(Exception):
+    pass
+
+
+def iter_cmd_list(f):
+    """Yields the elements of the "cmdList" array of a binary file object one by one.
+
+    Uses ijson if it is installed, otherwise an incremental raw_decode() over
+    READ_CHUNK_SIZE reads, so only the current element is held in memory.
+    """
+    if ijson is not None:
+        yield from ijson.items(f, "cmdList.item")
+        return
+
+    decoder = json.JSONDecoder()
+    text = codecs.getincrementaldecoder("utf-8")()
+    buf = ""
+    eof = False
+
+    def read_more():
+        nonlocal buf, eof
+        data = f.read(READ_CHUNK_SIZE)
+        eof = not data
+        buf += text.decode(data, final=eof)
+
+    # Skip to the array
+    while True:
+        match = CMD_LIST_START.search(buf)
+        if match:
+            buf = buf[match.end():]
+            break
+        if eof:
+            raise CommandImportError("missing cmdList element")
+        buf = buf[-32:]  # the key may be split between reads
+        read_more()
+
+    pos = 0
+    expect_item = True
+    while True:
+        while pos < len(buf) and buf[pos] in WHITESPACE:
+            pos += 1
+        if pos == len(buf):
+            if eof:
+                raise CommandImportError("unterminated cmdList")
+            buf = buf[pos:]
+            pos = 0
+            read_more()
+            continue
+
+        char = buf[pos]
+        if char == "]":
+            return
+        if not expect_item:
+            if char != ",":
+                raise CommandImportError(f"expected ',' in cmdList, got {char!r}")
+            pos += 1
+            expect_item = True
+            continue
+
+        try:
+            item, end = decoder.raw_decode(buf, pos)
+        except json.JSONDecodeError:
+            item, end = None, None
+        # An element touching the end of the buffer may still be cut off
+        if end is None or (end == len(buf) and not eof):
+            if eof:
+                raise CommandImportError("invalid element in cmdList")
+            buf = buf[pos:]
+            pos = 0
+            read_more()
+            continue
+        yield item
+        pos = end
+        expect_item = False
+        # Drop what was consumed so the buffer stays around READ_CHUNK_SIZE
+        if pos > READ_CHUNK_SIZE:
+            buf = buf[pos:]
+            pos = 0
+
+
+def validate_command(cmd, command_options=None):
+    # Returns None for a valid command, the reason otherwise
+    if not isinstance(cmd, str):
+        return f"not a string: {cmd!r}"
+    if not cmd or "\n" in cmd:
+        return "empty or multi-line command"
+    if command_options:
+        try:
+            compile_grammar(command_options).parse(cmd)
+        except CommandSyntaxError as e:
+            return str(e)
+    elif len(cmd.split(";")) < 4:
+        return "expected type;relay;state;priority;..."
+    return None
+
+
+def iter_chunks(commands, max_bytes=MAX_CHUNK_BYTES, max_commands=MAX_CHUNK_COMMANDS):
+    # Newline separated chunks, the format IMPORT_FROM_FILE expects
+    chunk = []
+    size = 0
+    for cmd in commands:
+        length = len(cmd.encode()) + 1
+        if chunk and (size + length > max_bytes or len(chunk) >= max_commands):
+            yield "\n".join(chunk) + "\n", len(chunk)
+            chunk = []
+            size = 0
+        chunk.append(cmd)
+        size += length
+    if chunk:
+        yield "\n".join(chunk) + "\n", len(chunk)
+
+
+def import_response(response):
+    """Whether a CMD_RESPONSE accepted an import chunk.
+
+    {"action": ..., "result": ...} or a bare result, None if the response
+    belongs to another action.
+    """
+    if isinstance(response, dict):
+        action = response.get("action")
+        if action is not None and action != IMPORT_ACTION:
+            return None
+        result = response.get("result")
+    else:
+        result = response.strip() if isinstance(response, str) else response
+    return result in OK_RESULTS
+
+
+class CommandImporter:
+    """Streams a command file to the controller on a background thread.
+
+    Valid commands are sent in bounded chunks, the next chunk only goes out
+    once the controller accepted the previous one with a CMD_RESPONSE. A
+    chunk the controller rejects stops the import, its commands count as
+    rejected. on_progress(fraction, imported, rejected) and on_done(error)
+    are called from the import thread.
+    """
+
+    def __init__(self, path, publish, command_options=None, on_progress=None, on_done=None,
+                 ack_timeout=ACK_TIMEOUT):
+        self.path = path
+        self.publish = publish
+        self.command_options = command_options
+        self.on_progress = on_progress
+        self.on_done = on_done
+        self.ack_timeout = ack_timeout
+        self.imported = 0
+        self.rejected = 0
+        self.rejected_chunks = 0
+        self.__response = None
+        self.__ack = threading.Event()
+        self.__cancel = threading.Event()
+        self.__thread = threading.Thread(target=self._run, name="CommandImport", daemon=True)
+
+    def start(self):
+        self.__thread.start()
+
+    def cancel(self):
+        self.__cancel.set()
+        self.__ack.set()
+
+    def acknowledge(self, response):
+        if import_response(response) is None:
+            return  # answer to another command
+        self.__response = response
+        self.__ack.set()
+
+    def _valid_commands(self, f):
+        for cmd in iter_cmd_list(f):
+            error = validate_command(cmd, self.command_options)
+            if error:
+                self.rejected += 1
+                print(f"Skipping command {cmd!r}: {error}")
+                continue
+            yield cmd
+
+    def _run(self):
+        error = None
+        try:
+            total = os.path.getsize(self.path) or 1
+            with open(self.path, "rb") as f:
+                for chunk, count in iter_chunks(self._valid_commands(f)):
+                    if self.__cancel.is_set():
+                        error = "cancelled"
+                        break
+                    self.__response = None
+                    self.__ack.clear()
+                    self.publish(chunk)
+                    if not self.__ack.wait(self.ack_timeout):
+                        error = f"no response from the controller in {self.ack_timeout:.0f}s"
+                        break
+                    if self.__cancel.is_set():
+                        error = "cancelled"
+                        break
+                    if not import_response(self.__response):
+                        self.rejected += count
+                        self.rejected_chunks += 1
+                        error = f"the controller rejected a chunk: {self.__response!r}"
+                        break
+                    self.imported += count
+                    if self.on_progress:
+                        self.on_progress(min(f.tell() / total, 1.0), self.imported, self.rejected)
+        except (OSError, CommandImportError, ValueError) as e:
+            error = str(e)
+        print(f"Import of {self.path}: {self.imported} imported, {self.rejected} rejected"
+              + (f" ({self.rejected_chunks} chunks by the controller)" if self.rejected_chunks else "")
+              + (f", stopped: {error}" if error else ""))
+        if self.on_done:
+            self.on_done(error)
@@ -0,0 +1,99 @@
+import re
+
+from CommandGrammar import CommandSyntaxError
+
+# field:value terms, anything else is matched against every word of a command
+FIELDS = ("type", "relay", "state", "priority")
+WORD_SPLIT = re.compile(r"[\s;:,]+")
+
+
+def command_fields(cmd, grammar=None):
+    # type, relay, state, priority of a command, None where it cannot be told
+    if grammar is not None:
+        try:
+            parsed = grammar.parse(cmd)
+            return parsed.type, parsed.relay, parsed.state, parsed.priority
+        except CommandSyntaxError:
+            pass
+    parts = cmd.split(";")
+    return tuple(parts[i] if i < len(parts) else None for i in range(len(FIELDS)))
+
+
+class CommandSearchIndex:
+    """Inverted index over the command list, kept up to date add / remove at a time.
+
+    Rows are identified by the caller's keys. A query is a list of terms that
+    all have to match: "field:value" compares one field (type, relay, state,
+    priority), a bare word matches any word of a command starting with it.
+    Matching is case-insensitive.
+    """
+
+    def __init__(self, grammar=None):
+        self.grammar = grammar
+        self.postings = {}  # token -> set of keys
+        self.tokens = {}  # key -> tokens of that row, to remove it again
+
+    def __len__(self):
+        return len(self.tokens)
+
+    def _tokens(self, cmd):
+        tokens = set()
+        for field, value in zip(FIELDS, command_fields(cmd, self.grammar)):
+            if value:
+                tokens.add(f"{field}:{value.lower()}")
+        for word in WORD_SPLIT.split(cmd.lower()):
+            if word:
+                tokens.add(word)
+        return tokens
+
+    def add(self, key, cmd):
+        tokens = self._tokens(cmd)
+        self.tokens[key] = tokens
+        for token in tokens:
+            self.postings.setdefault(token, set()).add(key)
+
+    def remove(self, key):
+        for token in self.tokens.pop(key, ()):
+            keys = self.postings[token]
+            keys.discard(key)
+            if not keys:
+                del self.postings[token]
+
+    def rebuild(self, items):
+        # items: (key, cmd) pairs, e.g. after the grammar changed
+        self.postings = {}
+        self.tokens = {}
+        for key, cmd in items:
+            self.add(key, cmd)
+
+    def _term_keys(self, field, value):
+        if field is not None:
+            return self.postings.get(f"{field}:{value}", set())
+        # Prefix match over the vocabulary, which is far smaller than the list
+        matches = set()
+        for token, keys in self.postings.items():
+            if ":" not in token and token.startswith(value):
+                matches |= keys
+        return matches
+
+    def query(self, text):
+        # Keys of the matching rows, None for an empty query (everything matches)
+        terms = []
+        for term in text.lower().split():
+            field, _, value = term.partition(":")
+            if value and field in FIELDS:
+                terms.append((field, value))
+            else:
+                terms.extend((None, word) for word in WORD_SPLIT.split(term) if word)
+        if not terms:
+            return None
+
+        # Exact field terms first, they are a single lookup and narrow the most
+        terms.sort(key=lambda term: term[0] is None)
+        result = None
+        for field, value in terms:
+            keys = self._term_keys(field, value)
+            result = set(keys) if result is None else result & keys
+            if not result:
+                break
+        return result
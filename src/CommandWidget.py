@@ -1,21 +1,24 @@
 import json
 import os
 
-from kivy.clock import mainthread
-from kivy.core.window import Window
+from kivy.clock import Clock, mainthread
 from kivy.metrics import dp
-from kivy.uix.label import Label
-from kivy.uix.scrollview import ScrollView
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivymd.app import MDApp
-from kivymd.uix.anchorlayout import MDAnchorLayout
 from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.uix.button import MDIconButton, MDRaisedButton
-from kivymd.uix.filemanager import MDFileManager
 from kivymd.uix.label import MDLabel
-from kivymd.uix.menu import MDDropdownMenu
+from kivymd.uix.progressbar import MDProgressBar
 from kivymd.uix.screen import MDScreen
 from kivymd.uix.textfield import MDTextField
 
+from CommandGrammar import END_CHAR, START_CHAR, CommandSyntaxError, ConflictIndex, compile_grammar
+from CommandImport import CommandImporter
+from CommandSearch import CommandSearchIndex
+from MessageModels import decode_command_list
+
 bulk_actions_list = [
     ("Save", "SAVE_ALL_CMDS", True),
     ("Reset", "RESET_CMDS_TO_DEFAULT", True),
@@ -24,8 +27,37 @@ bulk_actions_list = [
     ("Export", "EXPORT_CMD", False),
 ]
 
-START_CHAR = "startChar"
-END_CHAR = "endChar"
+
+class CommandRow(RecycleDataViewBehavior, MDBoxLayout):
+    # Recycled row of the command list, data: {"cmd": str, "remove_handler": callable}
+    def __init__(self, **kwargs):
+        super().__init__(
+            orientation="horizontal", spacing=dp(10), size_hint_y=None, height=dp(40), **kwargs
+        )
+        self.cmd = ""
+        self.remove_handler = None
+
+        self.label = MDLabel(
+            halign="left", size_hint_x=0.9, theme_text_color="Primary"
+        )
+        remove_btn = MDIconButton(
+            icon="close",
+            theme_text_color="Custom",
+            text_color=(1, 0, 0, 1),  # Red color
+            size_hint_x=0.1,
+            on_release=self.on_remove,
+        )
+        self.add_widget(self.label)
+        self.add_widget(remove_btn)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.label.text = data["cmd"]
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_remove(self, instance):
+        if self.remove_handler:
+            self.remove_handler(self.cmd)
+
 
 class CommandWidget(MDBoxLayout):
 
@@ -38,6 +70,18 @@ class CommandWidget(MDBoxLayout):
         self.menus = {}
         self.menu_buttons = {}
         self.command_list_data = None
+        self.command_rows = {}
+        self.command_counts = {}
+        self.command_options_data = None
+        # Compiled from CMD_OPTIONS, commands are checked against them before sending
+        self.grammar = None
+        self.conflict_index = None
+        # Command sent anyway when Add is pressed again despite a conflict warning
+        self.confirm_command = None
+        # Row key -> indexed fields, the list only shows the rows matching the filter
+        self.search_index = CommandSearchIndex()
+        self.filter_text = ""
+        self.importer = None
 
         # Add containers for both sections
         self.bulk_actions_layout = MDBoxLayout(
@@ -46,16 +90,29 @@ class CommandWidget(MDBoxLayout):
         self.options_container = MDBoxLayout(
             orientation="horizontal", spacing=dp(10), size_hint_y=None, height=dp(50)
         )
-        self.commands_list_container = MDBoxLayout(
-            orientation="vertical", spacing=dp(5), size_hint_y=None
+        # Only the visible rows get a widget, the rest lives in data
+        self.commands_list_container = RecycleBoxLayout(
+            orientation="vertical",
+            spacing=dp(5),
+            default_size=(None, dp(40)),
+            default_size_hint=(1, None),
+            size_hint_y=None,
         )
         self.commands_list_container.bind(
             minimum_height=self.commands_list_container.setter("height")
         )
 
-        command_list_scroll = ScrollView()
-        command_list_scroll.add_widget(self.commands_list_container)
-        command_list_scroll.size_hint_y = 1
+        self.search_input = MDTextField(
+            hint_text="Filter, e.g. type:ATime relay:R09 priority:P07 or any text",
+            size_hint_y=None,
+            height=dp(50),
+        )
+        self.filter_trigger = Clock.create_trigger(self.apply_filter, 0.1)
+        self.search_input.bind(text=lambda instance, text: self.filter_trigger())
+
+        self.command_list_view = RecycleView(size_hint_y=1)
+        self.command_list_view.viewclass = CommandRow
+        self.command_list_view.add_widget(self.commands_list_container)
 
         for label, action, use_mqtt in bulk_actions_list:
             btn = MDRaisedButton(
@@ -76,18 +133,27 @@ class CommandWidget(MDBoxLayout):
 
             self.bulk_actions_layout.add_widget(btn)
 
+        # Shown while a command file is imported
+        self.import_layout = MDBoxLayout(
+            orientation="horizontal", spacing=dp(10), size_hint_y=None, height=0, opacity=0
+        )
+        self.import_progress = MDProgressBar(max=1, value=0, size_hint_x=0.6)
+        self.import_label = MDLabel(size_hint_x=0.4, theme_text_color="Secondary")
+        # Cancels a running import, hides the finished one
+        self.import_cancel_button = MDIconButton(icon="close", on_release=self.cancel_import)
+        self.import_layout.add_widget(self.import_progress)
+        self.import_layout.add_widget(self.import_label)
+        self.import_layout.add_widget(self.import_cancel_button)
+
         self.add_widget(self.bulk_actions_layout)  # placeholder for command selectors
+        self.add_widget(self.import_layout)
         self.add_widget(self.options_container)  # placeholder for command selectors
-        self.add_widget(command_list_scroll)
+        self.add_widget(self.search_input)
+        self.add_widget(self.command_list_view)
 
+        # The file manager is only created when a file dialog is opened
         self.manager_open = False
-        self.file_manager = MDFileManager(
-            select_path=self.load_json,
-            exit_manager=self.close_file_manager,
-            preview=True,
-            search='all'  # allow files
-        )
-        self.file_manager.ext = [".json"]
+        self.file_manager = None
 
     def file_cmd_manager(self, action):
         if action == "IMPORT_FROM_FILE":
@@ -97,12 +163,26 @@ class CommandWidget(MDBoxLayout):
             self.export_json()
             pass
 
-    @mainthread
     def rebuild_cmd_options(self, command_options_data):
         if command_options_data is None:
             return
 
         self.command_options_data = command_options_data
+        try:
+            self.grammar = compile_grammar(command_options_data)
+            self.conflict_index = ConflictIndex(self.grammar)
+            if self.command_list_data is not None:
+                self.conflict_index.rebuild(self.command_list_data.commands)
+        except CommandSyntaxError as e:
+            print(f"Commands are not checked locally: {e}")
+            self.grammar = self.conflict_index = None
+        # Fields are told apart by the grammar where there is one
+        self.search_index.grammar = self.grammar
+        self.search_index.rebuild((key, key[0]) for key in self.command_rows)
+        self.apply_filter()
+        self.options_container.clear_widgets()
+        self.menu_buttons = {}
+        self.menus = {}
 
         # Add label
         label = MDLabel(text="Command:", size_hint=(None, None), size=(dp(100), dp(40)))
@@ -116,25 +196,14 @@ class CommandWidget(MDBoxLayout):
             )
             self.menu_buttons[key] = button
 
-            menu = MDDropdownMenu(
-                caller=button,
-                items=[
-                    {
-                        "viewclass": "OneLineListItem",
-                        "text": v,
-                        "on_release": lambda x=v, k=key: self.set_menu_value(k, x),
-                    }
-                    for v in values
-                ],
-                width_mult=4,
-            )
-            self.menus[key] = menu
-            button.bind(on_release=lambda *args, m=menu: m.open())
+            # The dropdown menu is created the first time the button is pressed
+            button.bind(on_release=lambda *args, k=key: self.open_menu(k))
             self.options_container.add_widget(button)
 
         # Add text input
         self.text_input = MDTextField(
             hint_text="Enter some text here",
+            helper_text_mode="on_error",
             size_hint=(None, None),
             size=(dp(180), dp(40)),
         )
@@ -147,41 +216,104 @@ class CommandWidget(MDBoxLayout):
         self.add_command_btn.bind(on_release=self.add_command)
         self.options_container.add_widget(self.add_command_btn)
 
-    @mainthread
     def rebuild_cmd_list(self, command_list_data):
-        print(f"rebuilding command list based on {command_list_data}")
-
-        self.commands_list_container.clear_widgets()
-
-        if not command_list_data or "cmdList" not in command_list_data:
+        # command_list_data: MessageModels.CommandList
+        if command_list_data is None:
+            self.command_rows = {}
+            self.command_counts = {}
+            self.search_index.rebuild(())
+            self.command_list_view.data = []
+            if self.conflict_index:
+                self.conflict_index.rebuild(())
             return
 
-        self.command_list_data = command_list_data
+        previous, self.command_list_data = self.command_list_data, command_list_data
+        if previous is not None and command_list_data.base_version is not None \
+                and command_list_data.base_version == previous.version \
+                and self._apply_cmd_delta(command_list_data.added, command_list_data.removed):
+            if self.conflict_index:
+                for cmd in command_list_data.removed:
+                    self.conflict_index.remove(cmd)
+                for cmd in command_list_data.added:
+                    self.conflict_index.add(cmd)
+            print(f"Command list {command_list_data.version}: +{len(command_list_data.added)} "
+                  f"-{len(command_list_data.removed)}, {len(command_list_data.commands)} commands")
+        else:
+            print(f"Rebuilding command list, {len(command_list_data.commands)} commands")
+            self._rebuild_cmd_rows(command_list_data.commands)
+            if self.conflict_index:
+                self.conflict_index.rebuild(command_list_data.commands)
+        self.apply_filter()
+
+    def apply_filter(self, *args):
+        self.filter_text = self.search_input.text
+        matches = self.search_index.query(self.filter_text)
+        if matches is None:
+            self.command_list_view.data = list(self.command_rows.values())
+        else:
+            self.command_list_view.data = [row for key, row in self.command_rows.items() if key in matches]
+
+    def _rebuild_cmd_rows(self, commands):
+        # Reuse the row data of untouched commands, create it for inserted ones.
+        # Removed commands simply drop out, the view recycles their widgets.
+        rows = {}
+        keys, self.command_counts = self._command_keys(commands)
+        for key in keys:
+            row = self.command_rows.get(key)
+            if row is None:
+                row = {"cmd": key[0], "remove_handler": self.remove_command}
+            rows[key] = row
+        for key in self.command_rows.keys() - rows.keys():
+            self.search_index.remove(key)
+        for key in rows.keys() - self.command_rows.keys():
+            self.search_index.add(key, key[0])
+        self.command_rows = rows
+
+    def _apply_cmd_delta(self, added, removed):
+        # The controller removes the first of duplicate commands, that would
+        # shift the occurrence keys, leave those to a rebuild
+        if len(set(removed)) != len(removed) or any(self.command_counts.get(cmd, 0) != 1 for cmd in removed):
+            return False
+        for cmd in removed:
+            del self.command_rows[(cmd, 0)]
+            del self.command_counts[cmd]
+            self.search_index.remove((cmd, 0))
+        for cmd in added:
+            occurrence = self.command_counts.get(cmd, 0)
+            self.command_counts[cmd] = occurrence + 1
+            self.command_rows[(cmd, occurrence)] = {"cmd": cmd, "remove_handler": self.remove_command}
+            self.search_index.add((cmd, occurrence), cmd)
+        return True
+
+    def _command_keys(self, cmd_list):
+        # The command string is the key, duplicates are told apart by occurrence
+        seen = {}
+        keys = []
+        for cmd in cmd_list:
+            occurrence = seen.get(cmd, 0)
+            seen[cmd] = occurrence + 1
+            keys.append((cmd, occurrence))
+        return keys, seen
+
+    def open_menu(self, key):
+        menu = self.menus.get(key)
+        if menu is None:
+            from kivymd.uix.menu import MDDropdownMenu
 
-        for cmd in command_list_data["cmdList"]:
-            row = MDBoxLayout(
-                orientation="horizontal",
-                spacing=dp(10),
-                size_hint_y=None,
-                height=dp(40),
-            )
-
-            label = MDLabel(
-                text=cmd, halign="left", size_hint_x=0.9, theme_text_color="Primary"
-            )
-
-            remove_btn = MDIconButton(
-                icon="close",
-                theme_text_color="Custom",
-                text_color=(1, 0, 0, 1),  # Red color
-                size_hint_x=0.1,
-                on_release=lambda instance, c=cmd: self.remove_command(c),
+            menu = MDDropdownMenu(
+                caller=self.menu_buttons[key],
+                items=[
+                    {
+                        "viewclass": "OneLineListItem",
+                        "text": v,
+                        "on_release": lambda x=v, k=key: self.set_menu_value(k, x),
+                    }
+                    for v in self.command_options_data[key]
+                ],
+                width_mult=4,
             )
-
-            row.add_widget(label)
-            row.add_widget(remove_btn)
-
-            self.commands_list_container.add_widget(row)
+            self.menus[key] = menu
+        menu.open()
 
     def set_menu_value(self, key, value):
         self.menu_buttons[key].text = value
@@ -201,28 +333,56 @@ class CommandWidget(MDBoxLayout):
 
     def add_command(self, instance):
         selected_values = {key: btn.text for key, btn in self.menu_buttons.items()}
-        selected_values['description'] = self.text_input.text
-        print("Selected Command:", selected_values)
-
-        cmd = self.command_options_data[START_CHAR]
-        cmd += ";".join(selected_values.values())
-        cmd += self.command_options_data[END_CHAR]
+        print("Selected Command:", selected_values, self.text_input.text)
+
+        if self.grammar is None:
+            cmd = self.command_options_data[START_CHAR]
+            cmd += ";".join(list(selected_values.values()) + [self.text_input.text])
+            cmd += self.command_options_data[END_CHAR]
+        else:
+            cmd = self.grammar.build(selected_values, self.text_input.text)
+            # Rejected here instead of after a round trip to the controller
+            try:
+                _, conflicts = self.conflict_index.check(cmd)
+            except CommandSyntaxError as e:
+                self.show_command_error(str(e))
+                return
+            if conflicts and cmd != self.confirm_command:
+                self.confirm_command = cmd
+                self.show_command_error(f"Conflicts with {conflicts[0].raw}, press Add again to send it anyway")
+                return
+        self.confirm_command = None
+        self.show_command_error(None)
         print("Sent Command: ", cmd)
 
         if self.mqtt_command_manager:
             self.mqtt_command_manager("ADD_CMD", cmd)
 
+    def show_command_error(self, error):
+        self.text_input.error = error is not None
+        self.text_input.helper_text = error or ""
+
     def remove_command(self, cmd):
         print(f"Removing command: {cmd}")
         if self.mqtt_command_manager:
             self.mqtt_command_manager("REMOVE_CMD", cmd)
 
     def open_file_manager(self, *args):
+        from kivymd.uix.filemanager import MDFileManager
+
+        self.file_manager = MDFileManager(
+            select_path=self.load_json,
+            exit_manager=self.close_file_manager,
+            preview=True,
+            search='all'  # allow files
+        )
+        self.file_manager.ext = [".json"]
         self.file_manager.show(os.path.expanduser("~"))  # or any folder
         self.manager_open = True
 
     def close_file_manager(self, *args):
-        self.file_manager.close()
+        if self.file_manager:
+            self.file_manager.close()
         self.manager_open = False
 
     def load_json(self, path):
@@ -230,24 +390,59 @@ class CommandWidget(MDBoxLayout):
         if not path.lower().endswith(".json"):
             print("Invalid file selected:", path)
             return
-        try:
-            with open(path, "r") as f:
-                data = json.load(f)
-                print(f"Imported JSON content: {os.path.basename(path)} {data}")
-        except Exception as e:
-            print("Error:", e)
+        if self.importer is not None:
+            print("An import is already running")
+            return
+        if not self.mqtt_command_manager:
+            return
+
+        print(f"Importing commands from {os.path.basename(path)}")
+        self.importer = CommandImporter(
+            path,
+            lambda chunk: self.mqtt_command_manager("IMPORT_FROM_FILE", chunk),
+            self.command_options_data,
+            on_progress=self.update_import_progress,
+            on_done=self.import_done,
+        )
+        self.show_import_progress(f"Importing {os.path.basename(path)}...")
+        self.importer.start()
 
-        if "cmdList" not in data:
-            print("missing cmdList element")
+    def cancel_import(self, *args):
+        if self.importer is not None:
+            self.importer.cancel()  # import_done() reports it
             return
+        self.import_layout.height = 0
+        self.import_layout.opacity = 0
 
-        cmd_list_compressed = ""
-        for cmd in data["cmdList"]:
-            cmd_list_compressed += cmd + "\n"
+    def on_cmd_response(self, response):
+        # The controller answers every import chunk, that lets the next one go
+        if self.importer is not None:
+            self.importer.acknowledge(response)
 
-        print(f"Compressed cmd list: {cmd_list_compressed}")
+    def show_import_progress(self, text):
+        self.import_progress.value = 0
+        self.import_label.text = text
+        self.import_layout.height = dp(30)
+        self.import_layout.opacity = 1
+
+    @mainthread
+    def update_import_progress(self, fraction, imported, rejected):
+        self.import_progress.value = fraction
+        self.import_label.text = f"{imported} imported, {rejected} rejected"
+
+    @mainthread
+    def import_done(self, error):
+        importer, self.importer = self.importer, None
+        if error:
+            self.import_label.text = (f"Import stopped: {error} "
+                                      f"({importer.imported} imported, {importer.rejected} rejected)")
+            return
+        self.import_progress.value = 1
+        self.import_label.text = f"{importer.imported} imported, {importer.rejected} rejected"
 
     def export_json(self, *args):
+        from kivymd.uix.filemanager import MDFileManager
+
         self.file_manager = MDFileManager(
             select_path=self.save_json_to_folder,
             exit_manager=self.close_file_manager,
@@ -268,7 +463,7 @@ class CommandWidget(MDBoxLayout):
 
         try:
             with open(export_path, "w") as f:
-                json.dump(self.command_list_data, f, indent=4)
+                json.dump(self.command_list_data.to_payload(), f, indent=4)
             print("Data exported to:", export_path)
         except Exception as e:
             print("Export error:", e)
@@ -293,7 +488,7 @@ class CommandApp(MDApp):
         screen = MDScreen()
         layout = MDBoxLayout(orientation="vertical", padding=dp(20), spacing=dp(10))
         command_options_data = json.loads(command_options)
-        command_list_data = json.loads(command_list)
+        command_list_data = decode_command_list(json.loads(command_list))
         self.commandWidget = CommandWidget()
         self.commandWidget.rebuild_cmd_options(command_options_data)
         self.commandWidget.rebuild_cmd_list(command_list_data)
@@ -0,0 +1,26 @@
+_MISSING = object()
+
+
+class UpdateCounter:
+    def __init__(self):
+        self.applied = 0
+        self.skipped = 0
+
+    def stats(self):
+        return {"applied": self.applied, "skipped": self.skipped}
+
+
+class RenderCache:
+    """Remembers the last value rendered per field so unchanged ones are skipped."""
+
+    def __init__(self, counter=None):
+        self.__last = {}
+        self.counter = counter if counter is not None else UpdateCounter()
+
+    def changed(self, field, value):
+        if self.__last.get(field, _MISSING) == value:
+            self.counter.skipped += 1
+            return False
+        self.__last[field] = value
+        self.counter.applied += 1
+        return True
@@ -0,0 +1,246 @@
+import bisect
+import json
+import math
+import mmap
+import os
+import queue
+import struct
+import threading
+import time
+
+HISTORY_DIR_PATH = "../history"
+KEYS_FILE_NAME = "keys.json"
+SEGMENT_PREFIX = "history-"
+SEGMENT_EXT = ".bin"
+INDEX_EXT = ".idx"
+
+# timestamp [s], key id, value
+RECORD = struct.Struct("<dHd")
+# timestamp [s], byte offset of the record in the segment
+INDEX_ENTRY = struct.Struct("<dQ")
+INDEX_EVERY = 256
+
+MAX_SEGMENT_BYTES = 4 * 1024 * 1024
+MAX_TOTAL_BYTES = 64 * 1024 * 1024
+
+
+def flatten_sensors(snapshot):
+    # MessageModels.SensorSnapshot, array sensors are already expanded to key_i
+    for sensor_key, value in snapshot.samples:
+        yield sensor_key.key, value
+
+
+def flatten_relays(records):
+    for record in records:
+        yield record.relay + "_state", 1.0 if record.state == "Opened" else 0.0
+
+
+def to_value(value):
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    return math.nan
+
+
+class HistoryStore:
+    """Append-only on-disk history of SENSORS and RELAYS samples.
+
+    Samples are written by a background thread into fixed size binary records.
+    Each segment has a sparse (timestamp, offset) index so a time range is read
+    through mmap starting near its first record. Old segments are deleted once
+    the total size goes over max_total_bytes.
+    """
+
+    def __init__(self, path=HISTORY_DIR_PATH, max_segment_bytes=MAX_SEGMENT_BYTES,
+                 max_total_bytes=MAX_TOTAL_BYTES):
+        self.path = path
+        self.max_segment_bytes = max_segment_bytes
+        self.max_total_bytes = max_total_bytes
+        os.makedirs(self.path, exist_ok=True)
+
+        self.__keys = self._load_keys()
+        self.__names = {key_id: key for key, key_id in self.__keys.items()}
+        self.__keys_lock = threading.Lock()
+        self.__queue = queue.Queue()
+        self.__segment = None
+        self.__index = None
+        self.__segment_size = 0
+        self.__segment_records = 0
+        self.__segment_ms = 0
+        self.__last_ts = 0.0
+        self.__thread = threading.Thread(target=self._writer_loop, name="HistoryStore", daemon=True)
+        self.__thread.start()
+
+    # Called from the MQTT thread, only queues the payload
+    def record_sensors(self, payload):
+        self.__queue.put((time.time(), flatten_sensors, payload))
+
+    def record_relays(self, payload):
+        self.__queue.put((time.time(), flatten_relays, payload))
+
+    def close(self):
+        self.__queue.put(None)
+        self.__thread.join()
+
+    def keys(self):
+        with self.__keys_lock:
+            return list(self.__keys)
+
+    def read_range(self, start_ts, end_ts, keys=None):
+        """Returns [(timestamp, key, value)] for start_ts <= timestamp <= end_ts."""
+        with self.__keys_lock:
+            wanted = None if keys is None else {self.__keys[k] for k in keys if k in self.__keys}
+            names = dict(self.__names)
+
+        samples = []
+        segments = self._segments()
+        for i, (first_ts, segment_path) in enumerate(segments):
+            next_ts = segments[i + 1][0] if i + 1 < len(segments) else math.inf
+            if next_ts < start_ts or first_ts > end_ts:
+                continue
+            self._read_segment(segment_path, start_ts, end_ts, wanted, names, samples)
+        return samples
+
+    def _read_segment(self, segment_path, start_ts, end_ts, wanted, names, samples):
+        offset = self._seek_offset(segment_path[:-len(SEGMENT_EXT)] + INDEX_EXT, start_ts)
+        try:
+            f = open(segment_path, "rb")
+        except FileNotFoundError:
+            return  # rotated away meanwhile
+        with f:
+            size = os.fstat(f.fileno()).st_size
+            size -= size % RECORD.size  # ignore a record that is being written
+            if size <= offset:
+                return
+            with mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as data:
+                for ts, key_id, value in RECORD.iter_unpack(data[offset:size]):
+                    if ts < start_ts:
+                        continue
+                    if ts > end_ts:
+                        break
+                    if wanted is None or key_id in wanted:
+                        samples.append((ts, names.get(key_id, str(key_id)), value))
+
+    def _seek_offset(self, index_path, start_ts):
+        try:
+            with open(index_path, "rb") as f:
+                raw = f.read()
+        except FileNotFoundError:
+            return 0
+        raw = raw[:len(raw) - len(raw) % INDEX_ENTRY.size]
+        entries = list(INDEX_ENTRY.iter_unpack(raw))
+        if not entries:
+            return 0
+        # Last indexed record strictly before start_ts
+        pos = bisect.bisect_left([ts for ts, _ in entries], start_ts) - 1
+        return entries[pos][1] if pos >= 0 else 0
+
+    def _segments(self):
+        segments = []
+        for name in os.listdir(self.path):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_EXT):
+                try:
+                    first_ts = int(name[len(SEGMENT_PREFIX):-len(SEGMENT_EXT)]) / 1000
+                except ValueError:
+                    continue
+                segments.append((first_ts, os.path.join(self.path, name)))
+        segments.sort()
+        return segments
+
+    def _load_keys(self):
+        try:
+            with open(os.path.join(self.path, KEYS_FILE_NAME)) as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return {}
+
+    def _save_keys(self):
+        keys_path = os.path.join(self.path, KEYS_FILE_NAME)
+        tmp_path = keys_path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(self.__keys, f)
+        os.replace(tmp_path, keys_path)
+
+    def _key_id(self, key):
+        key_id = self.__keys.get(key)
+        if key_id is None:
+            with self.__keys_lock:
+                key_id = len(self.__keys)
+                self.__keys[key] = key_id
+                self.__names[key_id] = key
+                self._save_keys()
+        return key_id
+
+    def _writer_loop(self):
+        running = True
+        while running:
+            batch = [self.__queue.get()]
+            while True:
+                try:
+                    batch.append(self.__queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            for item in batch:
+                if item is None:
+                    running = False
+                    break
+                ts, flatten, payload = item
+                try:
+                    self._write(ts, flatten(payload))
+                except Exception as e:
+                    print(f"HistoryStore: failed to write sample. Error: {e}")
+
+            if self.__segment:
+                self.__segment.flush()
+                self.__index.flush()
+
+        if self.__segment:
+            self.__segment.close()
+            self.__index.close()
+
+    def _write(self, ts, samples):
+        # Keep timestamps monotonic inside the store, the index relies on it
+        ts = max(ts, self.__last_ts)
+        self.__last_ts = ts
+        for key, value in samples:
+            if self.__segment is None or self.__segment_size >= self.max_segment_bytes:
+                self._rotate(ts)
+            if self.__segment_records % INDEX_EVERY == 0:
+                self.__index.write(INDEX_ENTRY.pack(ts, self.__segment_size))
+            self.__segment.write(RECORD.pack(ts, self._key_id(key), to_value(value)))
+            self.__segment_size += RECORD.size
+            self.__segment_records += 1
+
+    def _rotate(self, ts):
+        if self.__segment:
+            self.__segment.close()
+            self.__index.close()
+
+        # Segment names must stay unique even when rotating twice within a millisecond
+        self.__segment_ms = max(int(ts * 1000), self.__segment_ms + 1)
+        base = os.path.join(self.path, f"{SEGMENT_PREFIX}{self.__segment_ms}")
+        self.__segment = open(base + SEGMENT_EXT, "ab")
+        self.__index = open(base + INDEX_EXT, "ab")
+        self.__segment_size = self.__segment.tell()
+        self.__segment_records = self.__segment_size // RECORD.size
+        self._enforce_cap()
+
+    def _enforce_cap(self):
+        segments = self._segments()
+        sizes = [os.path.getsize(p) for _, p in segments]
+        total = sum(sizes)
+        # Never delete the segment that is being written. It is not always the
+        # newest by name, the wall clock may have stepped back since a restart.
+        current = os.path.abspath(self.__segment.name) if self.__segment else None
+        for (_, segment_path), size in zip(segments, sizes):
+            if total <= self.max_total_bytes:
+                break
+            if os.path.abspath(segment_path) == current:
+                continue
+            os.remove(segment_path)
+            index_path = segment_path[:-len(SEGMENT_EXT)] + INDEX_EXT
+            if os.path.exists(index_path):
+                os.remove(index_path)
+            total -= size
@@ -0,0 +1,318 @@
+import json
+import multiprocessing
+import pickle
+import queue
+import struct
+from multiprocessing import shared_memory
+
+from MessageModels import build_decoders
+from MQTTClient import MQTT_TOPICS_JSON_PATH
+
+# Topics where every message matters, they go through a queue instead of a slot.
+# CMD_LIST deltas are applied by the child's decoder, the slot holds the
+# resolved list and the UI only needs the latest one.
+EVENT_TOPIC_KEYS = ("CMD_RESPONSE",)
+SLOT_SIZE = 256 * 1024  # largest pickled frame a topic slot holds [bytes]
+SLOT_HEADER = struct.Struct("<QI4x")  # sequence, frame length
+SLOT_SEQUENCE = struct.Struct("<Q")
+SLOT_LENGTH = struct.Struct("<I")
+LENGTH_OFFSET = SLOT_SEQUENCE.size
+STATS_TIMEOUT = 1.0
+
+
+def attach_shared_memory(name):
+    try:
+        # Only the creating process may unlink it, keep the child's tracker out
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:  # Python < 3.13
+        return shared_memory.SharedMemory(name=name)
+
+
+class FrameSlots:
+    """Latest frame of each topic in shared memory, one seqlock guarded slot per topic.
+
+    The writer makes the sequence odd while it copies a frame and the length,
+    the even sequence is stored last when done. A reader only keeps a copy if the sequence was even and did not
+    change while it read, otherwise it tries again on the next poll. Older
+    frames are simply overwritten, the UI only renders the latest one.
+
+    A frame larger than the slot is not stored, the slot then holds an empty
+    frame with its sequence and the writer sends the frame another way.
+    newer() tells the reader whether such a frame is still the latest one.
+    """
+
+    def __init__(self, shm, topics, slot_size=SLOT_SIZE):
+        self.shm = shm
+        self.slot_size = slot_size
+        self.offsets = {
+            topic: i * (SLOT_HEADER.size + slot_size) for i, topic in enumerate(topics)
+        }
+        self.__sequences = dict.fromkeys(topics, 0)
+        self.__delivered = dict.fromkeys(topics, 0)
+        self.oversized = 0
+
+    @staticmethod
+    def size(topic_count, slot_size=SLOT_SIZE):
+        return topic_count * (SLOT_HEADER.size + slot_size)
+
+    # writer side, child process
+    def write(self, topic, frame):
+        # Returns the sequence of the frame and whether it fit into the slot
+        fits = len(frame) <= self.slot_size
+        buf = self.shm.buf
+        offset = self.offsets[topic]
+        sequence = self.__sequences[topic] + 1
+        SLOT_SEQUENCE.pack_into(buf, offset, sequence)
+        if fits:
+            start = offset + SLOT_HEADER.size
+            buf[start:start + len(frame)] = frame
+        else:
+            self.oversized += 1
+        SLOT_LENGTH.pack_into(buf, offset + LENGTH_OFFSET, len(frame) if fits else 0)
+        sequence += 1
+        SLOT_SEQUENCE.pack_into(buf, offset, sequence)  # a separate, last store
+        self.__sequences[topic] = sequence
+        return sequence, fits
+
+    # reader side, UI process
+    def read_new(self):
+        buf = self.shm.buf
+        frames = []
+        for topic, offset in self.offsets.items():
+            sequence, length = SLOT_HEADER.unpack_from(buf, offset)
+            if sequence == self.__sequences[topic] or sequence & 1:
+                continue
+            start = offset + SLOT_HEADER.size
+            if length > self.slot_size:
+                continue  # torn header, read again on the next poll
+            frame = bytes(buf[start:start + length])
+            if SLOT_HEADER.unpack_from(buf, offset) != (sequence, length):
+                continue  # overwritten while copying
+            self.__sequences[topic] = sequence
+            if length and self.newer(topic, sequence):
+                frames.append((topic, frame))
+        return frames
+
+    def newer(self, topic, sequence):
+        # False for a frame older than the last one handed out on the topic
+        if sequence <= self.__delivered[topic]:
+            return False
+        self.__delivered[topic] = sequence
+        return True
+
+
+def run_ingest(shm_name, slot_topics, slot_size, event_topics, commands, events, record_history):
+    # Child process: MQTT, decoding and history recording, no Kivy
+    from HistoryStore import HistoryStore
+    from MQTTClient import MQTTClient
+
+    shm = attach_shared_memory(shm_name)
+    slots = FrameSlots(shm, slot_topics, slot_size)
+    history_store = HistoryStore() if record_history else None
+    client = MQTTClient(lambda client, userdata, flags, rc: events.put(("connect", flags, rc)))
+    client.status_callback = lambda status, color: events.put(("status", status, color))
+
+    recorders = {}
+    if history_store:
+        recorders[client.SUB_TOPICS["RELAYS"]] = history_store.record_relays
+        recorders[client.SUB_TOPICS["SENSORS"]] = history_store.record_sensors
+
+    def slot_callback(topic):
+        record = recorders.get(topic)
+
+        def callback(payload):
+            if record:
+                record(payload)
+            sequence, stored = slots.write(topic, pickle.dumps(payload, pickle.HIGHEST_PROTOCOL))
+            if not stored:
+                # Too large for the slot, e.g. a big sensor snapshot, the queue takes any size
+                events.put(("frame", topic, sequence, payload))
+        return callback
+
+    callbacks = {topic: slot_callback(topic) for topic in slot_topics}
+    for topic in event_topics:
+        callbacks[topic] = lambda payload, t=topic: events.put(("message", t, payload))
+    client.setTopicsCallback(callbacks)
+
+    try:
+        while True:
+            command, *args = commands.get()
+            if command == "stop":
+                break
+            elif command == "connect":
+                client.connect_to_server(*args)
+            elif command == "disconnect":
+                client.disconnect_from_server()
+            elif command == "publish":
+                client.commandManager(*args)
+            elif command == "override":
+                client.overrideCommand(*args)
+            elif command == "capture":
+                client.start_capture(*args)
+            elif command == "stop_capture":
+                client.stop_capture()
+            elif command == "replay":
+                client.start_replay(*args, on_done=lambda count, elapsed: events.put(("replay_done", count, elapsed)))
+            elif command == "stop_replay":
+                client.stop_replay()
+            elif command == "stats":
+                events.put(("stats", client.decoder.stats(), client.publish_stats()))
+    finally:
+        client.stop_replay()
+        client.stop_capture()
+        client.disconnect_from_server()
+        if history_store:
+            history_store.close()
+        shm.close()
+
+
+class RemoteDecoder:
+    # Stand-in for MQTTClient.decoder, the statistics live in the child
+    backend = "ingest process"
+
+    def __init__(self, ingest_client):
+        self.ingest_client = ingest_client
+
+    def stats(self):
+        return self.ingest_client.request_stats()[0]
+
+
+class IngestProcessClient:
+    """MQTTClient look-alike whose receive / decode path runs in a child process.
+
+    Decoded snapshots arrive through FrameSlots and are handed to the topic
+    callbacks from poll(), once per frame on the UI thread. Event topics,
+    frames too large for a slot and status changes come through a queue,
+    publishes go to the child the same way.
+    """
+
+    records_history = True
+
+    def __init__(self, on_connect_callback, slot_size=SLOT_SIZE):
+        with open(MQTT_TOPICS_JSON_PATH) as f:
+            data = json.load(f)
+            self.SUB_TOPICS = data["Subscribe"]
+            self.PUB_TOPICS = data["Publish"]
+        self.models = build_decoders(self.SUB_TOPICS)
+        self.decoder = RemoteDecoder(self)
+        self.on_connect_callback = on_connect_callback
+        self.status_callback = None
+        self.replay_done_callback = None
+        self.__callbacks = {}
+
+        event_topics = [self.SUB_TOPICS[key] for key in EVENT_TOPIC_KEYS]
+        slot_topics = [topic for topic in self.SUB_TOPICS.values() if topic not in event_topics]
+        self.shm = shared_memory.SharedMemory(create=True, size=FrameSlots.size(len(slot_topics), slot_size))
+        self.slots = FrameSlots(self.shm, slot_topics, slot_size)
+
+        # spawn: forking a process that already runs Kivy / GL is not safe
+        context = multiprocessing.get_context("spawn")
+        self.commands = context.Queue()
+        self.events = context.Queue()
+        self.process = context.Process(
+            target=run_ingest,
+            args=(self.shm.name, slot_topics, slot_size, event_topics, self.commands, self.events, self.records_history),
+            name="MqttIngest",
+            daemon=True,
+        )
+        self.process.start()
+
+        from kivy.clock import Clock
+
+        self.poll_event = Clock.schedule_interval(self.poll, 0)
+
+    def setTopicsCallback(self, callback):
+        self.__callbacks = callback
+
+    def poll(self, *args):
+        for topic, frame in self.slots.read_new():
+            try:
+                payload = pickle.loads(frame)
+            except Exception as e:
+                print(f"Skipping unreadable frame on {topic}. Error: {e}")
+                continue
+            self._dispatch(topic, payload)
+        while True:
+            try:
+                event = self.events.get_nowait()
+            except queue.Empty:
+                return
+            self._handle_event(event)
+
+    def _dispatch(self, topic, payload):
+        callback = self.__callbacks.get(topic)
+        if callback is None:
+            return
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"Failed to handle {topic}. Error: {e}")
+
+    def _handle_event(self, event):
+        kind, *args = event
+        if kind == "message":
+            self._dispatch(*args)
+        elif kind == "frame":
+            topic, sequence, payload = args
+            if self.slots.newer(topic, sequence):
+                self._dispatch(topic, payload)
+        elif kind == "connect":
+            flags, rc = args
+            if rc == 0:
+                self.on_connect_callback(None, None, flags, rc)
+        elif kind == "status":
+            if self.status_callback:
+                self.status_callback(*args)
+        elif kind == "replay_done":
+            if self.replay_done_callback:
+                self.replay_done_callback(*args)
+
+    def request_stats(self):
+        self.commands.put(("stats",))
+        try:
+            while True:
+                event = self.events.get(timeout=STATS_TIMEOUT)
+                if event[0] == "stats":
+                    return event[1:]
+                self._handle_event(event)
+        except queue.Empty:
+            return {}, {}
+
+    def publish_stats(self):
+        return self.request_stats()[1]
+
+    def connect_to_server(self, broker, port):
+        self.commands.put(("connect", broker, port))
+        return True
+
+    def disconnect_from_server(self):
+        # Only called on shutdown, the child process ends with the connection
+        if not self.process.is_alive():
+            return
+        self.poll_event.cancel()
+        self.commands.put(("stop",))
+        self.process.join()
+        self.shm.close()
+        self.shm.unlink()
+
+    def requestForAllInfo(self):
+        self.commandManager("GET_ALL_INFO")
+
+    def commandManager(self, action_topic, command=""):
+        self.commands.put(("publish", action_topic, command))
+
+    def overrideCommand(self, command):
+        self.commands.put(("override", command))
+
+    def start_capture(self, path):
+        self.commands.put(("capture", path))
+
+    def stop_capture(self):
+        self.commands.put(("stop_capture",))
+
+    def start_replay(self, path, speed=1.0, on_done=None):
+        self.replay_done_callback = on_done
+        self.commands.put(("replay", path, speed))
+
+    def stop_replay(self):
+        self.commands.put(("stop_replay",))
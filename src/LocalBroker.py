@@ -0,0 +1,157 @@
+import queue
+import threading
+
+# Same value as paho.mqtt.client.MQTT_ERR_NO_CONN
+MQTT_ERR_NO_CONN = 4
+
+
+class LocalMessage:
+    __slots__ = ("topic", "payload", "qos", "retain")
+
+    def __init__(self, topic, payload, qos=0, retain=False):
+        self.topic = topic
+        self.payload = payload
+        self.qos = qos
+        self.retain = retain
+
+
+class LocalPublishInfo:
+    # Stand-in for paho's MQTTMessageInfo
+    def __init__(self, mid):
+        self.mid = mid
+        self.rc = 0
+
+    def is_published(self):
+        return True
+
+    def wait_for_publish(self, timeout=None):
+        pass
+
+
+class LocalBroker:
+    """In-process stand-in for an MQTT broker, exact topic matching only."""
+
+    def __init__(self):
+        self.__lock = threading.Lock()
+        self.__subscribers = {}
+        self.published = 0
+
+    def subscribe(self, topic, client):
+        with self.__lock:
+            self.__subscribers.setdefault(topic, set()).add(client)
+
+    def unsubscribe_all(self, client):
+        with self.__lock:
+            for clients in self.__subscribers.values():
+                clients.discard(client)
+
+    def publish(self, topic, payload, qos=0, retain=False):
+        if payload is None:
+            payload = b""
+        elif isinstance(payload, str):
+            payload = payload.encode("utf-8")
+        with self.__lock:
+            clients = list(self.__subscribers.get(topic, ()))
+            self.published += 1
+        for client in clients:
+            client.deliver(LocalMessage(topic, payload, qos, retain))
+
+
+class LocalClient:
+    """Subset of paho.mqtt.client.Client that talks to a LocalBroker.
+
+    Messages are delivered on the client's own network thread, like paho's
+    loop_start(), or on the thread calling loop(), so the threading seen by
+    MQTTClient is the same.
+    """
+
+    def __init__(self, broker):
+        self.broker = broker
+        self.on_connect = None
+        self.on_disconnect = None
+        self.on_message = None
+        self.on_publish = None
+        self.__inbox = queue.Queue()
+        self.__thread = None
+        self.__connected = False
+        self.__mid = 0
+
+    def connect(self, host, port=1883, keepalive=60):
+        self.__connected = True
+        self.__inbox.put(("connect", None))
+        return 0
+
+    def connect_async(self, host, port=1883, keepalive=60):
+        return self.connect(host, port, keepalive)
+
+    def reconnect(self):
+        return self.connect(None)
+
+    def disconnect(self):
+        self.__connected = False
+        self.broker.unsubscribe_all(self)
+        self.__inbox.put(("disconnect", None))
+        return 0
+
+    def is_connected(self):
+        return self.__connected
+
+    def loop_start(self):
+        if self.__thread is None:
+            self.__thread = threading.Thread(target=self._loop, name="LocalClient", daemon=True)
+            self.__thread.start()
+        return 0
+
+    def loop_stop(self):
+        if self.__thread is not None:
+            self.__inbox.put(("stop", None))
+            self.__thread.join()
+            self.__thread = None
+        return 0
+
+    def loop(self, timeout=1.0):
+        # Like paho: handles what arrived within timeout, non-zero once disconnected
+        try:
+            item = self.__inbox.get(timeout=timeout)
+            while True:
+                self.__dispatch(*item)
+                item = self.__inbox.get_nowait()
+        except queue.Empty:
+            pass
+        return 0 if self.__connected else MQTT_ERR_NO_CONN
+
+    def subscribe(self, topic, qos=0):
+        self.broker.subscribe(topic, self)
+        return 0, self.__next_mid()
+
+    def publish(self, topic, payload=None, qos=0, retain=False):
+        info = LocalPublishInfo(self.__next_mid())
+        self.broker.publish(topic, payload, qos, retain)
+        if self.on_publish:
+            self.on_publish(self, None, info.mid)
+        return info
+
+    def deliver(self, message):
+        self.__inbox.put(("message", message))
+
+    def __next_mid(self):
+        self.__mid += 1
+        return self.__mid
+
+    def _loop(self):
+        while True:
+            kind, message = self.__inbox.get()
+            if kind == "stop":
+                return
+            self.__dispatch(kind, message)
+
+    def __dispatch(self, kind, message):
+        try:
+            if kind == "connect" and self.on_connect:
+                self.on_connect(self, None, {}, 0)
+            elif kind == "disconnect" and self.on_disconnect:
+                self.on_disconnect(self, None, 0)
+            elif kind == "message" and self.on_message:
+                self.on_message(self, None, message)
+        except Exception as e:
+            print(f"LocalClient: callback failed. Error: {e}")
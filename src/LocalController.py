@@ -0,0 +1,108 @@
+import json
+import threading
+
+from LocalBroker import LocalClient
+from MQTTClient import MQTT_TOPICS_JSON_PATH
+
+DEFAULT_COMMANDS = [
+    "Manua;RXX;Closed;P00;F",
+    "ATime;R09;Closed;P07;06:00-07:00",
+]
+COMMAND_OPTIONS = {
+    "startChar": "",
+    "endChar": "",
+    "CommandType": ["Manua", "ATemp", "AHumi", "ATime", "AFlow", "AMost"],
+    "RelayIds": [f"R{i:02d}" for i in range(1, 17)] + ["RXX"],
+    "RelayState": ["Opened", "Closed"],
+    "CmdPriority": ["PLW", "P00", "P01", "P02", "P03", "P04", "P05", "P06", "P07", "P08", "P09", "PHI"],
+}
+
+
+class LocalController:
+    """Stand-in for the irrigation controller's command handling on a LocalBroker.
+
+    Speaks the versioned command list protocol: full snapshots on request,
+    add/remove deltas for every change, and a CMD_RESPONSE for every request.
+    lose_next_delta() drops one delta to exercise the GUI's gap handling.
+    """
+
+    def __init__(self, broker, commands=DEFAULT_COMMANDS):
+        with open(MQTT_TOPICS_JSON_PATH) as f:
+            data = json.load(f)
+            self.SUB_TOPICS = data["Subscribe"]
+            self.PUB_TOPICS = data["Publish"]
+        self.default_commands = list(commands)
+        self.commands = list(commands)
+        self.version = 1
+        self.__lose_next_delta = False
+        self.__lock = threading.Lock()
+
+        self.handlers = {
+            "ADD_CMD": lambda payload: self.change([payload], []),
+            "REMOVE_CMD": lambda payload: self.change([], [payload]),
+            "IMPORT_FROM_FILE": lambda payload: self.change([line for line in payload.split("\n") if line], []),
+            "RESET_CMDS_TO_DEFAULT": lambda payload: self.reset(),
+            "GET_CMD_LIST": lambda payload: self.publish_cmd_list(),
+            "GET_CMD_OPTIONS": lambda payload: self.publish_options(),
+            "GET_ALL_INFO": lambda payload: self.publish_all(),
+        }
+        self.topic_keys = {topic: key for key, topic in self.PUB_TOPICS.items()}
+
+        self.client = LocalClient(broker)
+        self.client.on_message = self.on_message
+        self.client.connect("local")
+        self.client.loop_start()
+        for topic in self.PUB_TOPICS.values():
+            self.client.subscribe(topic)
+
+    def stop(self):
+        self.client.disconnect()
+        self.client.loop_stop()
+
+    def lose_next_delta(self):
+        self.__lose_next_delta = True
+
+    def on_message(self, client, userdata, msg):
+        key = self.topic_keys.get(msg.topic)
+        payload = msg.payload.decode("utf-8")
+        handler = self.handlers.get(key)
+        with self.__lock:
+            if handler:
+                handler(payload)
+            self.publish("CMD_RESPONSE", {"action": key, "result": "OK"})
+
+    def change(self, added, removed):
+        removed = [cmd for cmd in removed if cmd in self.commands]
+        if not added and not removed:
+            return
+        for cmd in removed:
+            self.commands.remove(cmd)
+        self.commands.extend(added)
+        self.version += 1
+        if self.__lose_next_delta:
+            self.__lose_next_delta = False
+            return
+        self.publish("CMD_LIST", {
+            "version": self.version,
+            "baseVersion": self.version - 1,
+            "added": added,
+            "removed": removed,
+        })
+
+    def reset(self):
+        self.commands = list(self.default_commands)
+        self.version += 1
+        self.publish_cmd_list()
+
+    def publish_cmd_list(self):
+        self.publish("CMD_LIST", {"version": self.version, "cmdList": self.commands})
+
+    def publish_options(self):
+        self.publish("CMD_OPTIONS", COMMAND_OPTIONS)
+
+    def publish_all(self):
+        self.publish_options()
+        self.publish_cmd_list()
+
+    def publish(self, topic_key, payload):
+        self.client.publish(self.SUB_TOPICS[topic_key], json.dumps(payload))
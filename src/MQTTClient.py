@@ -1,36 +1,154 @@
 import json
+import random
+import threading
+import time
 
 import paho.mqtt.client as mqtt
 
+from MessageModels import CommandListSkipped, build_decoders
+from MqttCapture import CaptureWriter, replay_capture
+from PayloadDecoder import DecodeErrors, PayloadDecoder
+from PublishQueue import PUBLISH_QOS, PUBLISH_RATE, PublishQueue
+
 # Define MQTT topics
 
 MQTT_TOPICS_JSON_PATH = "../config/MqttTopics.json"
+# Snapshot topics where a byte-identical repeat can be skipped
+DEDUP_TOPIC_KEYS = ("SENSORS", "RELAYS", "CMD_LIST", "CMD_OPTIONS")
+# Reconnect backoff [s], doubled per failed attempt and jittered
+RECONNECT_MIN_DELAY = 1.0
+RECONNECT_MAX_DELAY = 60.0
+NETWORK_LOOP_TIMEOUT = 1.0
+# "thread": paho's network loop on a connection thread (default)
+# "asyncio": on the asyncio loop the app runs on, see AsyncioTransport
+TRANSPORTS = ("thread", "asyncio")
+# Override for all relays, supersedes pending per-relay overrides
+ALL_RELAYS = "RXX"
+
+
+def reconnect_delay(attempt):
+    delay = min(RECONNECT_MAX_DELAY, RECONNECT_MIN_DELAY * 2 ** attempt)
+    # Jitter keeps a fleet of kiosks from reconnecting in lockstep
+    return random.uniform(delay / 2, delay)
+
+
 class MQTTClient:
-    def __init__(self, on_connect_callback):
-        self.client = mqtt.Client()
+    records_history = False
+
+    def __init__(self, on_connect_callback, client=None, transport="thread",
+                 publish_rate=PUBLISH_RATE, publish_qos=PUBLISH_QOS):
+        # client can be any paho Client look-alike, e.g. LocalBroker.LocalClient
+        if transport not in TRANSPORTS:
+            raise ValueError(f"Unknown MQTT transport {transport}, expected one of {TRANSPORTS}")
+        self.client = client if client is not None else mqtt.Client()
         self.client.on_connect = self.on_connect
         self.client.on_message = self.on_message
+        self.client.on_disconnect = self.on_disconnect
+        # Every publish goes through the queue, rapid overrides are collapsed there
+        self.publish_queue = PublishQueue(self.client, rate=publish_rate, qos=publish_qos)
+        self.client.on_publish = self.publish_queue.on_publish
         self.on_connect_callback = on_connect_callback
+        # status_callback(status, color) is told about every connection state change
+        self.status_callback = None
         self.subscribed_topics = set()
+        self.connection_thread = None
+        self.connection_stop = threading.Event()
+        self.reconnect_attempt = 0
+        self.capture_writer = None
+        self.replay_thread = None
+        self.replay_stop = threading.Event()
         with open(MQTT_TOPICS_JSON_PATH) as f:
             data = json.load(f)
             self.SUB_TOPICS = data["Subscribe"]
             self.PUB_TOPICS = data["Publish"]
+        self.decoder = PayloadDecoder(self.SUB_TOPICS[key] for key in DEDUP_TOPIC_KEYS)
+        self.async_transport = None
+        if transport == "asyncio":
+            from AsyncioTransport import AsyncioTransport
+
+            self.async_transport = AsyncioTransport(self)
+        self.models = build_decoders(self.SUB_TOPICS, self.requestCommandList)
 
     def setTopicsCallback(self, callback):
         self.__callbacks = callback
 
     def requestForAllInfo(self):
-        self.client.publish(self.PUB_TOPICS["GET_ALL_INFO"], "")
+        self.commandManager("GET_ALL_INFO")
+
+    def requestCommandList(self):
+        # Full command list, after a gap in the delta versions
+        self.commandManager("GET_CMD_LIST")
+
+    def set_status(self, status, color):
+        print(f"MQTT status: {status}")
+        if self.status_callback:
+            self.status_callback(status, color)
 
     def connect_to_server(self, broker, port):
+        # disconnect_from_server() stopped the queue
+        self.publish_queue.start()
+        if self.async_transport:
+            return self.async_transport.connect(broker, port)
+
+        # Never blocks: connecting, the network loop and reconnecting all run
+        # on the connection thread
+        previous_thread, previous_stop = self.connection_thread, self.connection_stop
+        previous_stop.set()
+        self.connection_stop = threading.Event()
+        self.connection_thread = threading.Thread(
+            target=self._connection_loop,
+            args=(broker, port, self.connection_stop, previous_thread),
+            name="MqttConnection",
+            daemon=True,
+        )
+        self.connection_thread.start()
+        return True
+
+    def disconnect_from_server(self):
+        self.publish_queue.close()
+        if self.async_transport:
+            self.async_transport.disconnect()
+            return
+        self.connection_stop.set()
+        if self.connection_thread:
+            # A connect() to an unreachable broker blocks until the TCP / DNS
+            # timeout, the daemon thread is left to finish on its own
+            self.connection_thread.join(NETWORK_LOOP_TIMEOUT * 2)
+            if self.connection_thread.is_alive():
+                print("MQTT connection thread still busy, not waiting for it")
+            self.connection_thread = None
+
+    def _connection_loop(self, broker, port, stop, previous_thread):
+        if previous_thread:
+            previous_thread.join()
+
+        self.reconnect_attempt = 0
+        while not stop.is_set():
+            self.set_status(f"Connecting to {broker}:{port}...", "orange")
+            try:
+                self.client.connect(broker, port, 60)
+                rc = mqtt.MQTT_ERR_SUCCESS
+                while rc == mqtt.MQTT_ERR_SUCCESS and not stop.is_set():
+                    rc = self.client.loop(timeout=NETWORK_LOOP_TIMEOUT)
+            except Exception as e:
+                print(f"Connection failed: {e}")
+
+            # The broker drops subscriptions with a clean session
+            self.subscribed_topics.clear()
+            if stop.is_set():
+                break
+
+            delay = reconnect_delay(self.reconnect_attempt)
+            self.reconnect_attempt += 1
+            self.set_status(f"Disconnected, retrying in {delay:.0f}s", "red")
+            stop.wait(delay)
+
         try:
-            self.client.connect(broker, port, 60)
-            self.client.loop_start()
-            return True
-        except Exception as e:
-            print(f"Connection failed: {e}")
-            return False
+            self.client.disconnect()
+        except Exception:
+            pass
+        self.subscribed_topics.clear()
+        self.set_status("Disconnected", "red")
 
     def subscribe(self, topic):
         if topic in self.subscribed_topics:
@@ -42,44 +160,116 @@ class MQTTClient:
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
             print("Connected successfully to MQTT broker")
+            self.reconnect_attempt = 0
+            self.decoder.reset()
             for topic in self.SUB_TOPICS.values():
                 self.subscribe(topic)
 
             self.on_connect_callback(client, userdata, flags, rc)
+            self.set_status("Connected", "green")
 
             self.requestForAllInfo()
         else:
             print(f"Connection failed with code {rc}")
+            self.set_status(f"Connection refused ({rc})", "red")
+
+    def on_disconnect(self, client, userdata, rc):
+        self.subscribed_topics.clear()
+        if rc != 0:
+            print(f"Unexpectedly disconnected with code {rc}")
+
+    # capture / replay
+    def start_capture(self, path):
+        self.stop_capture()
+        self.capture_writer = CaptureWriter(path)
+        print(f"Capturing MQTT traffic to {path}")
+
+    def stop_capture(self):
+        if self.capture_writer:
+            self.capture_writer.close()
+            print(f"Captured {self.capture_writer.count} messages to {self.capture_writer.path}")
+            self.capture_writer = None
+
+    def start_replay(self, path, speed=1.0, on_done=None):
+        # speed: 1.0 real time, N for N times faster, None/0 as fast as possible
+        self.stop_replay()
+        self.replay_stop.clear()
+
+        def run():
+            start = time.perf_counter()
+            count = replay_capture(path, self.on_message, speed, self.replay_stop)
+            elapsed = time.perf_counter() - start
+            print(f"Replayed {count} messages from {path} in {elapsed:.2f}s")
+            if on_done:
+                on_done(count, elapsed)
+
+        self.replay_thread = threading.Thread(target=run, name="MqttReplay", daemon=True)
+        self.replay_thread.start()
+
+    def stop_replay(self):
+        if self.replay_thread and self.replay_thread.is_alive():
+            self.replay_stop.set()
+            self.replay_thread.join()
+        self.replay_thread = None
 
     def on_message(self, client, userdata, msg):
+        if self.capture_writer:
+            self.capture_writer.write(time.time(), msg.topic, msg.payload)
+
         topic = msg.topic
-        payload = msg.payload.decode('utf-8')
 
         if topic not in self.__callbacks.keys():
             print(f"Topic {topic} not handled")
             return
 
         try:
-            parsedPayload = json.loads(payload)
+            is_new, parsedPayload = self.decoder.decode(topic, msg.payload)
+        except DecodeErrors as e:
+            # Catch JSON decoding errors specifically
+            print(f"JSONDecodeError: Failed to parse payload. Error: {e}")
+            print(f"Payload: {msg.payload}")
+            return
+
+        # Byte-identical snapshot, nothing changed since the last one
+        if not is_new:
+            return
+
+        model = self.models.get(topic)
+        if model is not None:
+            try:
+                parsedPayload = model(parsedPayload)
+            except CommandListSkipped as e:
+                print(f"Command list update skipped: {e}")
+                return
+            except ValueError as e:
+                print(f"Invalid payload on {topic}. Error: {e}")
+                return
+
+        try:
             if not parsedPayload:
                 print(f"Pares payload is none")
             self.__callbacks[topic](parsedPayload)
-
-        except json.JSONDecodeError as e:
-            # Catch JSON decoding errors specifically
-            print(f"JSONDecodeError: Failed to parse payload. Error: {e}")
-            print(f"Payload: {payload}")
         except Exception as e:
             # General exception for any other errors
-            print(f"Failed to parse {payload}. Error: {e}")
+            print(f"Failed to handle {msg.payload}. Error: {e}")
     # publish
     def commandManager(self, action_topic, command=""):
         if action_topic not in self.PUB_TOPICS.keys():
             print(f"Invalid command action: {self.PUB_TOPICS}")
             return
-        self.client.publish(self.PUB_TOPICS[action_topic], command)
-        print(f"{self.PUB_TOPICS[action_topic]} published {command}")
+        topic = self.PUB_TOPICS[action_topic]
+        # Repeated requests without a command (save, load, reset...) collapse into one
+        self.publish_queue.submit(topic, command, key=None if command else topic)
 
     def overrideCommand(self, command):
-        self.client.publish(self.PUB_TOPICS["OVERRIDE_CMD"], command)
-        print(f'{self.PUB_TOPICS["OVERRIDE_CMD"]} published {command}')
+        # Manua;{relay};{state};{priority}; only the last override per relay is sent
+        fields = command.split(";")
+        relay = fields[1] if len(fields) > 1 else None
+        supersedes = None
+        if relay == ALL_RELAYS:
+            supersedes = lambda key: isinstance(key, tuple) and key[0] == "OVERRIDE"
+        key = ("OVERRIDE", relay) if relay else None
+        self.publish_queue.submit(self.PUB_TOPICS["OVERRIDE_CMD"], command, key=key, supersedes=supersedes)
+
+    def publish_stats(self):
+        return self.publish_queue.stats()
@@ -0,0 +1,205 @@
+class RelayRecord:
+    __slots__ = ("relay", "index", "state", "cmd", "priority")
+
+    def __init__(self, relay, index, state, cmd, priority):
+        self.relay = relay
+        self.index = index
+        self.state = state
+        self.cmd = cmd
+        self.priority = priority
+
+    def to_payload(self):
+        return {"state": self.state, "cmd": self.cmd, "priority": self.priority}
+
+
+class SensorKey:
+    # Precomputed once per sensor key, shared by every sample of that key
+    __slots__ = ("key", "name", "unit")
+
+    def __init__(self, key):
+        self.key = key
+        if "_" in key:
+            self.name, self.unit = key.split("_", 1)
+        else:
+            self.name, self.unit = key, ""
+
+    def __reduce__(self):
+        # Unpickled keys (e.g. from the ingest process) are the shared instances too
+        return sensor_key, (self.key,)
+
+
+_SENSOR_KEYS = {}
+
+
+def sensor_key(key):
+    # One SensorKey per key in the process, the store and history compare them by identity
+    instance = _SENSOR_KEYS.get(key)
+    if instance is None:
+        instance = _SENSOR_KEYS[key] = SensorKey(key)
+    return instance
+
+
+class SensorSnapshot:
+    # samples: list of (SensorKey, value), array sensors are already expanded to key_i
+    __slots__ = ("samples", "raw")
+
+    def __init__(self, samples, raw):
+        self.samples = samples
+        self.raw = raw
+
+    def to_payload(self):
+        return self.raw
+
+
+class CommandList:
+    # version is None for controllers that only send unversioned full lists.
+    # A list built from a delta keeps base_version / added / removed, so views
+    # that show base_version can apply just the change.
+    __slots__ = ("commands", "version", "base_version", "added", "removed")
+
+    def __init__(self, commands, version=None, base_version=None, added=(), removed=()):
+        self.commands = commands
+        self.version = version
+        self.base_version = base_version
+        self.added = added
+        self.removed = removed
+
+    def to_payload(self):
+        if self.version is None:
+            return {"cmdList": list(self.commands)}
+        return {"version": self.version, "cmdList": list(self.commands)}
+
+
+NO_RELAY_INDEX = 1 << 30
+
+
+def relay_index(relay):
+    # "R07" -> 7, anything without a number sorts last
+    digits = "".join(c for c in relay if c.isdigit())
+    return int(digits) if digits else NO_RELAY_INDEX
+
+
+class RelayDecoder:
+    def __init__(self):
+        self.__indexes = {}
+
+    def __call__(self, payload):
+        if not isinstance(payload, dict):
+            raise ValueError(f"relay payload must be an object, got {type(payload).__name__}")
+        records = []
+        indexes = self.__indexes
+        for relay, attributes in payload.items():
+            if not isinstance(attributes, dict):
+                raise ValueError(f"relay {relay} must be an object")
+            index = indexes.get(relay)
+            if index is None:
+                index = indexes[relay] = relay_index(relay)
+            records.append(RelayRecord(
+                relay,
+                index,
+                attributes.get("state", ""),
+                attributes.get("cmd", ""),
+                attributes.get("priority", ""),
+            ))
+        return records
+
+
+class SensorDecoder:
+    def __init__(self):
+        self.__array_keys = {}
+
+    def key(self, key):
+        return sensor_key(key)
+
+    def __call__(self, payload):
+        if not isinstance(payload, dict):
+            raise ValueError(f"sensor payload must be an object, got {type(payload).__name__}")
+        samples = []
+        for key, value in payload.items():
+            if isinstance(value, list):
+                array_keys = self.__array_keys.get(key)
+                if array_keys is None or len(array_keys) < len(value):
+                    array_keys = self.__array_keys[key] = [self.key(f"{key}_{i}") for i in range(len(value))]
+                samples.extend(zip(array_keys, value))
+            else:
+                samples.append((self.key(key), value))
+        return SensorSnapshot(samples, payload)
+
+
+def _command_strings(payload, key):
+    commands = payload.get(key, [])
+    if not isinstance(commands, list) or not all(isinstance(cmd, str) for cmd in commands):
+        raise ValueError(f"{key} must be a list of strings")
+    return commands
+
+
+def decode_command_list(payload):
+    if not isinstance(payload, dict) or "cmdList" not in payload:
+        return None
+    return CommandList(tuple(_command_strings(payload, "cmdList")), payload.get("version"))
+
+
+class CommandListSkipped(ValueError):
+    # The message does not lead to a new list, e.g. an old or out of order delta
+    pass
+
+
+class CommandListDecoder:
+    """Keeps the command list across versioned snapshots and add/remove deltas.
+
+    Snapshot: {"version": n, "cmdList": [...]} (version is optional)
+    Delta:    {"version": n, "baseVersion": n - 1, "added": [...], "removed": [...]}
+
+    A delta that does not follow the current version cannot be applied, then
+    request_snapshot() is called so the controller resends the full list. Only
+    a replay of the current version is dropped without asking.
+    """
+
+    def __init__(self, request_snapshot=None):
+        self.request_snapshot = request_snapshot
+        self.current = None
+
+    def __call__(self, payload):
+        if not isinstance(payload, dict):
+            raise ValueError(f"command list must be an object, got {type(payload).__name__}")
+        if "baseVersion" not in payload:
+            self.current = decode_command_list(payload)
+            return self.current
+
+        version = payload.get("version")
+        base_version = payload["baseVersion"]
+        current_version = self.current.version if self.current else None
+        if current_version is not None and version == current_version:
+            raise CommandListSkipped(f"delta to {version} is already applied")
+        # Also an older version: the controller restarted and counts from 0 again
+        if current_version is None or base_version != current_version:
+            if self.request_snapshot:
+                self.request_snapshot()
+            raise CommandListSkipped(f"delta from {base_version} does not follow {current_version}, "
+                                     "requested the full list")
+
+        added = _command_strings(payload, "added")
+        removed = _command_strings(payload, "removed")
+        commands = list(self.current.commands)
+        for cmd in removed:
+            try:
+                commands.remove(cmd)
+            except ValueError:
+                pass
+        commands.extend(added)
+        self.current = CommandList(tuple(commands), version, base_version, tuple(added), tuple(removed))
+        return self.current
+
+
+def build_decoders(sub_topics, request_cmd_list=None):
+    """topic -> decoder, built once from the "Subscribe" section of MqttTopics.json.
+
+    Topics without a typed model pass the parsed JSON through unchanged.
+    request_cmd_list() asks the controller for a full command list.
+    """
+    models = {
+        "RELAYS": RelayDecoder(),
+        "SENSORS": SensorDecoder(),
+        "CMD_LIST": CommandListDecoder(request_cmd_list),
+    }
+    return {topic: models[key] for key, topic in sub_topics.items() if key in models}
@@ -0,0 +1,81 @@
+import struct
+import threading
+import time
+
+CAPTURE_MAGIC = b"SJIRSCAP1\n"
+# timestamp [s], topic length, payload length
+RECORD_HEADER = struct.Struct("<dHI")
+
+
+class CapturedMessage:
+    # Quacks like paho's MQTTMessage as far as MQTTClient.on_message cares
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class CaptureWriter:
+    def __init__(self, path):
+        self.path = path
+        self.__lock = threading.Lock()
+        self.__file = open(path, "wb")
+        self.__file.write(CAPTURE_MAGIC)
+        self.count = 0
+
+    def write(self, timestamp, topic, payload):
+        topic_bytes = topic.encode("utf-8")
+        with self.__lock:
+            if self.__file is None:
+                return
+            self.__file.write(RECORD_HEADER.pack(timestamp, len(topic_bytes), len(payload)))
+            self.__file.write(topic_bytes)
+            self.__file.write(payload)
+            self.count += 1
+
+    def close(self):
+        with self.__lock:
+            if self.__file is not None:
+                self.__file.close()
+                self.__file = None
+
+
+def read_capture(path):
+    """Yields (timestamp, topic, payload bytes) from a capture file."""
+    with open(path, "rb") as f:
+        if f.read(len(CAPTURE_MAGIC)) != CAPTURE_MAGIC:
+            raise ValueError(f"{path} is not a capture file")
+        while True:
+            header = f.read(RECORD_HEADER.size)
+            if len(header) < RECORD_HEADER.size:
+                return
+            timestamp, topic_len, payload_len = RECORD_HEADER.unpack(header)
+            topic = f.read(topic_len).decode("utf-8")
+            payload = f.read(payload_len)
+            if len(payload) < payload_len:
+                return  # truncated last record
+            yield timestamp, topic, payload
+
+
+def replay_capture(path, on_message, speed=1.0, stop_event=None):
+    """Feeds a capture through on_message(client, userdata, msg).
+
+    speed=1.0 keeps the recorded timing, speed=N plays N times faster and
+    speed=None (or 0) plays as fast as possible. Returns the message count.
+    """
+    count = 0
+    first_ts = None
+    start = time.perf_counter()
+    for timestamp, topic, payload in read_capture(path):
+        if stop_event is not None and stop_event.is_set():
+            break
+        if speed:
+            if first_ts is None:
+                first_ts = timestamp
+            delay = (timestamp - first_ts) / speed - (time.perf_counter() - start)
+            if delay > 0:
+                time.sleep(delay)
+        on_message(None, None, CapturedMessage(topic, payload))
+        count += 1
+    return count
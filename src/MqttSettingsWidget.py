@@ -8,6 +8,12 @@ from kivymd.uix.boxlayout import MDBoxLayout
 from kivymd.app import MDApp
 from kivy.clock import mainthread
 
+STATUS_COLORS = {
+    "green": (0, 1, 0, 1),
+    "orange": (1, 0.6, 0, 1),
+    "red": (1, 0, 0, 1),
+}
+
 class MQTTSettingsWidget(MDCard):
     connection_status = StringProperty("Disconnected")
     local_time = StringProperty("--:--")
@@ -22,7 +28,7 @@ class MQTTSettingsWidget(MDCard):
     def update_status(self, status, color):
         self.connection_status = status
         self.status_label.text = status
-        self.status_label.color = (0, 1, 0, 1) if color == "green" else (1, 0, 0, 1)
+        self.status_label.color = STATUS_COLORS.get(color, STATUS_COLORS["red"])
 
     def on_connect(self, client, userdata, flags, rc):
         if rc == 0:
@@ -61,9 +67,14 @@ class MQTTSettingsWidget(MDCard):
         self.add_widget(mqtt_layout)
     
     def connect_to_broker(self, instance):
-        # Placeholder function to handle MQTT connection
         print(f"Connecting to broker... {self.broker_input.text} {self.port_input.text}")
-        self.connect(self.broker_input.text, int(self.port_input.text))
+        try:
+            port = int(self.port_input.text)
+        except ValueError:
+            self.update_status("Invalid port number", "red")
+            return
+        # Returns right away, the progress is reported through update_status
+        self.connect(self.broker_input.text, port)
 
 
 class MqttSettingsApp(MDApp):
@@ -0,0 +1,88 @@
+import json
+import time
+
+# Fastest available JSON backend, the stdlib is the fallback
+try:
+    import orjson
+
+    JSON_BACKEND = "orjson"
+
+    def _loads(raw):
+        return orjson.loads(raw)
+
+    DecodeErrors = (orjson.JSONDecodeError, UnicodeDecodeError)
+except ImportError:
+    try:
+        import ujson
+
+        JSON_BACKEND = "ujson"
+
+        def _loads(raw):
+            return ujson.loads(raw)
+
+        DecodeErrors = (ValueError,)
+    except ImportError:
+        JSON_BACKEND = "json"
+
+        def _loads(raw):
+            return json.loads(raw.decode("utf-8"))
+
+        DecodeErrors = (json.JSONDecodeError, UnicodeDecodeError)
+
+
+class TopicStats:
+    __slots__ = ("decoded", "dedup_hits", "parse_time")
+
+    def __init__(self):
+        self.decoded = 0
+        self.dedup_hits = 0
+        self.parse_time = 0.0
+
+    def as_dict(self):
+        return {
+            "decoded": self.decoded,
+            "dedup_hits": self.dedup_hits,
+            "parse_ms_total": round(self.parse_time * 1000, 3),
+            "parse_ms_avg": round(self.parse_time * 1000 / self.decoded, 3) if self.decoded else None,
+        }
+
+
+class PayloadDecoder:
+    """Decodes raw MQTT payloads, skipping byte-identical repeats of snapshot topics.
+
+    decode() returns (is_new, payload). is_new is False when the raw bytes equal
+    the last payload of a dedup topic, then nothing is parsed.
+    """
+
+    def __init__(self, dedup_topics=()):
+        self.dedup_topics = set(dedup_topics)
+        self.backend = JSON_BACKEND
+        self.__last_raw = {}
+        self.__stats = {}
+
+    def reset(self):
+        # Forget the last payloads, e.g. after reconnecting, so the next ones go through
+        self.__last_raw.clear()
+
+    def decode(self, topic, raw):
+        stats = self.__stats.get(topic)
+        if stats is None:
+            stats = self.__stats[topic] = TopicStats()
+
+        if topic in self.dedup_topics:
+            if self.__last_raw.get(topic) == raw:
+                stats.dedup_hits += 1
+                return False, None
+
+        start = time.perf_counter()
+        payload = _loads(raw)
+        stats.parse_time += time.perf_counter() - start
+        stats.decoded += 1
+
+        # Only remember payloads that parsed, a broken one must not mask the next
+        if topic in self.dedup_topics:
+            self.__last_raw[topic] = bytes(raw)
+        return True, payload
+
+    def stats(self):
+        return {topic: stats.as_dict() for topic, stats in self.__stats.items()}
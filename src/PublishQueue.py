@@ -0,0 +1,134 @@
+import threading
+import time
+from collections import OrderedDict
+
+DEBOUNCE_WINDOW = 0.3  # a keyed message waits this long for a newer one [s]
+PUBLISH_RATE = 20.0  # messages per second
+PUBLISH_QOS = 0
+
+
+class PublishQueue:
+    """Outbound messages, published in order by a worker thread.
+
+    A message submitted with a key replaces a pending message with the same
+    key, so a burst of clicks on the same relay leaves only the last intent.
+    Keyed messages are held for the debounce window after the first one of a
+    burst, publishing is spread out to at most rate messages per second.
+    """
+
+    def __init__(self, client, window=DEBOUNCE_WINDOW, rate=PUBLISH_RATE, qos=PUBLISH_QOS):
+        self.client = client
+        self.window = window
+        self.interval = 1.0 / rate if rate else 0.0
+        self.qos = qos
+        self.__condition = threading.Condition()
+        self.__pending = OrderedDict()  # key -> [topic, payload, due]
+        self.__next_publish = 0.0
+        self.__flush = False
+        self.__stopped = True
+        self.__in_flight = set()
+        self.__completed_early = set()
+        self.submitted = 0
+        self.superseded = 0
+        self.published = 0
+        self.failed = 0
+        self.__thread = None
+        self.start()
+
+    def start(self):
+        # Starts the worker, again after close() when the client reconnects
+        with self.__condition:
+            if not self.__stopped:
+                return
+            self.__stopped = False
+            self.__flush = False
+        self.__thread = threading.Thread(target=self._worker_loop, name="PublishQueue", daemon=True)
+        self.__thread.start()
+
+    def submit(self, topic, payload, key=None, supersedes=None):
+        # supersedes: key -> bool, pending messages it matches are dropped
+        with self.__condition:
+            self.submitted += 1
+            if supersedes is not None:
+                for pending_key in [k for k in self.__pending if supersedes(k)]:
+                    del self.__pending[pending_key]
+                    self.superseded += 1
+
+            entry = self.__pending.get(key) if key is not None else None
+            if entry is not None:
+                # Keeps its place in the queue and its due time, only the intent changes
+                entry[0], entry[1] = topic, payload
+                self.superseded += 1
+            else:
+                due = time.monotonic() + (self.window if key is not None else 0.0)
+                self.__pending[key if key is not None else object()] = [topic, payload, due]
+            self.__condition.notify()
+
+    def on_publish(self, client, userdata, mid):
+        with self.__condition:
+            if mid in self.__in_flight:
+                self.__in_flight.remove(mid)
+            else:
+                # Acknowledged before publish() returned its mid
+                self.__completed_early.add(mid)
+
+    def stats(self):
+        with self.__condition:
+            return {
+                "depth": len(self.__pending),
+                "in_flight": len(self.__in_flight),
+                "submitted": self.submitted,
+                "superseded": self.superseded,
+                "published": self.published,
+                "failed": self.failed,
+            }
+
+    def close(self):
+        # Publishes what is pending right away, then stops the worker
+        with self.__condition:
+            self.__flush = True
+            self.__stopped = True
+            self.__condition.notify()
+        self.__thread.join()
+
+    def _next_message(self):
+        with self.__condition:
+            while True:
+                if not self.__pending:
+                    if self.__stopped:
+                        return None
+                    self.__condition.wait()
+                    continue
+                key, (topic, payload, due) = next(iter(self.__pending.items()))
+                now = time.monotonic()
+                wait = 0.0 if self.__flush else max(due, self.__next_publish) - now
+                if wait > 0:
+                    self.__condition.wait(wait)
+                    continue
+                del self.__pending[key]
+                self.__next_publish = now + self.interval
+                return topic, payload
+
+    def _worker_loop(self):
+        while True:
+            message = self._next_message()
+            if message is None:
+                return
+            topic, payload = message
+            try:
+                info = self.client.publish(topic, payload, qos=self.qos)
+            except Exception as e:
+                self.failed += 1
+                print(f"Failed to publish on {topic}. Error: {e}")
+                continue
+            if info.rc != 0:
+                self.failed += 1
+                print(f"Failed to publish on {topic}, rc {info.rc}")
+                continue
+            with self.__condition:
+                self.published += 1
+                if info.mid in self.__completed_early:
+                    self.__completed_early.remove(info.mid)
+                else:
+                    self.__in_flight.add(info.mid)
+            print(f"{topic} published {payload}")
@@ -1,12 +1,18 @@
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
 from kivymd.app import MDApp
-from kivymd.uix.gridlayout import MDGridLayout
 from kivymd.uix.label import MDLabel
-from kivymd.uix.scrollview import MDScrollView
 from kivymd.uix.button import MDRaisedButton
 from kivymd.uix.selectioncontrol import MDCheckbox
 from kivymd.uix.boxlayout import MDBoxLayout
 import json
 
+from DirtyFields import RenderCache, UpdateCounter
+from MessageModels import RelayDecoder
+
+ROW_HEIGHT = 40
+
 class ColoredLabel(MDLabel):
     def __init__(self, text, state, **kwargs):
         super().__init__(text=text, **kwargs)
@@ -32,27 +38,117 @@ class AutoCheckbox(MDBoxLayout):
         super().__init__(orientation="horizontal", size_hint_x=0.5, **kwargs)
         self.relay = relay
         self.callback = callback
+        self.__updating = False
         
         self.add_widget(MDLabel(text="Auto"))
         self.checkbox = MDCheckbox()
         self.checkbox.bind(active=self.on_checkbox_toggle)
         self.add_widget(self.checkbox)
 
+    def set_active(self, value):
+        # Reflect a stored state without reporting it back as a user change
+        self.__updating = True
+        self.checkbox.active = value
+        self.__updating = False
+
     def on_checkbox_toggle(self, instance, value):
-        self.callback(self.relay, value)
-
-class RelayStatesWidget(MDGridLayout):
-    def __init__(self, toggle_handler=None, **kwargs):
-        super().__init__(**kwargs)
-        self.__label_map = {}
-        self.__buttons = {}
-        self.__checkboxes = {}
+        if not self.__updating and self.callback:
+            self.callback(self.relay, value)
+
+class RelayRow(RecycleDataViewBehavior, MDBoxLayout):
+    # Recycled row of the relay table, all per relay state lives in the row data
+    update_counter = UpdateCounter()
+
+    def __init__(self, **kwargs):
+        super().__init__(orientation="horizontal", spacing=5, size_hint_y=None, height=ROW_HEIGHT, **kwargs)
+        self.relay = ""
+        self.toggle_handler = None
+        self.__rendered = RenderCache(RelayRow.update_counter)
+
+        self.name_label = MDLabel(size_hint_y=None, height=ROW_HEIGHT)
+        self.state_label = ColoredLabel(text="", state="", size_hint_y=None, height=ROW_HEIGHT)
+        self.cmd_label = MDLabel(size_hint_y=None, height=ROW_HEIGHT)
+        self.priority_label = MDLabel(size_hint_y=None, height=ROW_HEIGHT)
+        self.toggle_button = MDRaisedButton(text="Toggle")
+        self.toggle_button.bind(on_press=self.on_toggle)
+        self.auto_checkbox = AutoCheckbox("", None)
+
+        self.add_widget(self.name_label)
+        self.add_widget(self.state_label)
+        self.add_widget(self.cmd_label)
+        self.add_widget(self.priority_label)
+        self.add_widget(self.toggle_button)
+        self.add_widget(self.auto_checkbox)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.relay = data["relay"]
+        self.toggle_handler = data["toggle_handler"]
+        # Only reassign labels whose value differs from what this view shows
+        rendered = self.__rendered
+        if rendered.changed("relay", data["relay"]):
+            self.name_label.text = data["relay"]
+        if rendered.changed("state", data["state"]):
+            self.state_label.update_state(data["state"])
+        if rendered.changed("cmd", data["cmd"]):
+            self.cmd_label.text = data["cmd"]
+        if rendered.changed("priority", data["priority"]):
+            self.priority_label.text = data["priority"]
+        self.toggle_button.disabled = data["toggle_disabled"]
+        self.auto_checkbox.relay = data["relay"]
+        self.auto_checkbox.callback = data["auto_handler"]
+        self.auto_checkbox.set_active(data["auto"])
+        return super().refresh_view_attrs(rv, index, data)
+
+    def on_toggle(self, instance):
+        if self.toggle_handler:
+            self.toggle_handler(self.relay)
+
+class RelayStatesWidget(MDBoxLayout):
+    def __init__(self, toggle_handler=None, state_getter=None, **kwargs):
+        super().__init__(orientation="vertical", **kwargs)
+        self.__rows = {}
+        self.__indexes = {}  # relay -> RelayRecord.index, the rows are shown in that order
         self.__toggle_handler = toggle_handler
-        self.__built_already = False
+        # Current relay state from the model (StateStore.relay_state), the rows otherwise
+        self.__state_getter = state_getter
         self.__auto_handler = None
+        self.__all_auto = False
+        self.padding = [10, 10]
+        self.spacing = 5
+
+        header = MDBoxLayout(orientation="horizontal", spacing=5, size_hint_y=None, height=ROW_HEIGHT)
+        for title in ["Relay", "State", "Command", "Priority"]:
+            header.add_widget(MDLabel(text=title, size_hint_y=None, height=ROW_HEIGHT))
+
+        relay = "RXX"
+        self.__toggle_all_button = MDRaisedButton(text="Toggle all")
+        self.__toggle_all_button.bind(on_press=lambda instance, r=relay: self.toggle(r))
+        header.add_widget(self.__toggle_all_button)
+        header.add_widget(AutoCheckbox(relay, self.auto_mode_changed))
+        self.add_widget(header)
+
+        # Only rows on screen own widgets
+        layout = RecycleBoxLayout(
+            orientation="vertical",
+            spacing=5,
+            default_size=(None, ROW_HEIGHT),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+        )
+        layout.bind(minimum_height=layout.setter("height"))
+        self.relay_view = RecycleView()
+        self.relay_view.viewclass = RelayRow
+        self.relay_view.add_widget(layout)
+        self.add_widget(self.relay_view)
 
     def toggle(self, relay):
-        state = self.__label_map[f"{relay}_state"].state if relay != "RXX" else self.__label_map["R01_state"].state
+        if not self.__rows:
+            return
+        state_relay = relay if relay != "RXX" else next(iter(self.__rows))
+        if self.__state_getter:
+            state = self.__state_getter(state_relay)
+        else:
+            state = self.__rows[state_relay]["state"]
         state = "Opened" if state == "Closed" else "Closed"
         print(f"Toggled {relay} to {state}")
         if self.__toggle_handler:
@@ -60,58 +156,58 @@ class RelayStatesWidget(MDGridLayout):
 
     def auto_mode_changed(self, relay, state):
         if relay == "RXX":
-            for button in self.__buttons.values():
-                button.disabled = state
+            self.__all_auto = state
+            self.__toggle_all_button.disabled = state
         else:
-            self.__buttons[f"{relay}_toggle"].disabled = state
+            self.__rows[relay]["auto"] = state
+        for row in self.__rows.values():
+            row["toggle_disabled"] = self.__all_auto or row["auto"]
+        self.relay_view.refresh_from_data()
         print(f"Auto mode for {relay}: {'Enabled' if state else 'Disabled'}")
         if self.__auto_handler:
             self.__auto_handler(relay, state)
 
-    def build_or_update(self, relay_data):
-        if not self.__built_already:
-            self.cols = len(next(iter(relay_data.values()))) + 3
-            self.size_hint_y = None
-            self.row_default_height = 40
-            self.padding = [10, 10]
-            self.spacing = 5
-            self.height = (len(relay_data) + 1) * self.row_default_height
-            
-            self.__label_map["Relay_header"] = MDLabel(text="Relay", size_hint_y=None, height=self.row_default_height)
-            self.__label_map["State"] = MDLabel(text="State", size_hint_y=None, height=self.row_default_height)
-            self.__label_map["Command"] = MDLabel(text="Command", size_hint_y=None, height=self.row_default_height)
-            self.__label_map["Priority"] = MDLabel(text="Priority", size_hint_y=None, height=self.row_default_height)
-            self.add_widget(self.__label_map["Relay_header"])
-            self.add_widget(self.__label_map["State"])
-            self.add_widget(self.__label_map["Command"])
-            self.add_widget(self.__label_map["Priority"])
-
-            relay = "RXX"
-            self.__buttons[f"{relay}_toggle"] = MDRaisedButton(text="Toggle all")
-            self.__buttons[f"{relay}_toggle"].bind(on_press=lambda instance, r=relay: self.toggle(r))
-            self.add_widget(self.__buttons[f"{relay}_toggle"])
-            self.add_widget(AutoCheckbox(relay, self.auto_mode_changed))
-            self.__built_already = True
-        
-        for relay, attributes in relay_data.items():
-            if f'{relay}_name' not in self.__label_map:
-                self.__label_map[f"{relay}_name"] = MDLabel(text=relay, size_hint_y=None, height=self.row_default_height)
-                self.__label_map[f"{relay}_state"] = ColoredLabel(text=attributes.get("state", ""), state=attributes.get("state", ""), size_hint_y=None, height=self.row_default_height)
-                self.__label_map[f"{relay}_cmd"] = MDLabel(text=attributes.get("cmd", ""), size_hint_y=None, height=self.row_default_height)
-                self.__label_map[f"{relay}_priority"] = MDLabel(text=attributes.get("priority", ""), size_hint_y=None, height=self.row_default_height)
-                self.add_widget(self.__label_map[f"{relay}_name"])
-                self.add_widget(self.__label_map[f"{relay}_state"])
-                self.add_widget(self.__label_map[f"{relay}_cmd"])
-                self.add_widget(self.__label_map[f"{relay}_priority"])
-
-                self.__buttons[f"{relay}_toggle"] = MDRaisedButton(text="Toggle")
-                self.__buttons[f"{relay}_toggle"].bind(on_press=lambda instance, r=relay: self.toggle(r))
-                self.add_widget(self.__buttons[f"{relay}_toggle"])
-                self.add_widget(AutoCheckbox(relay, self.auto_mode_changed))
-            else:
-                self.__label_map[f"{relay}_state"].update_state(attributes.get("state", ""))
-                self.__label_map[f"{relay}_cmd"].text = attributes.get("cmd", "")
-                self.__label_map[f"{relay}_priority"].text = attributes.get("priority", "")
+    def update_stats(self):
+        return RelayRow.update_counter.stats()
+
+    def build_or_update(self, relay_records):
+        added = False
+        changed = False
+        for record in relay_records:
+            row = self.__rows.get(record.relay)
+            if row is None:
+                self.__rows[record.relay] = {
+                    "relay": record.relay,
+                    "state": record.state,
+                    "cmd": record.cmd,
+                    "priority": record.priority,
+                    "auto": False,
+                    "toggle_disabled": self.__all_auto,
+                    "toggle_handler": self.toggle,
+                    "auto_handler": self.auto_mode_changed,
+                }
+                self.__indexes[record.relay] = record.index
+                added = True
+                continue
+
+            # Only decides whether to refresh, the rows count applied / skipped fields
+            row_changed = False
+            if row["state"] != record.state:
+                row["state"] = record.state
+                row_changed = True
+            if row["cmd"] != record.cmd:
+                row["cmd"] = record.cmd
+                row_changed = True
+            if row["priority"] != record.priority:
+                row["priority"] = record.priority
+                row_changed = True
+            changed = changed or row_changed
+
+        if added:
+            order = sorted(self.__rows, key=lambda relay: (self.__indexes[relay], relay))
+            self.relay_view.data = [self.__rows[relay] for relay in order]
+        elif changed:
+            self.relay_view.refresh_from_data()
 
 class RelayApp(MDApp):
     def build(self):
@@ -133,13 +229,9 @@ class RelayApp(MDApp):
         "R15": { "state": "Closed", "cmd": "Manua;RXX;Closed;P00;F", "priority": "P00" },
         "R16": { "state": "Closed", "cmd": "Manua;RXX;Closed;P00;F", "priority": "P00" }}
         """)
-        scroll_view = MDScrollView()
-        grid = RelayStatesWidget(size_hint_y=None)
-        grid.build_or_update(relay_data)
-        scroll_view.add_widget(grid)
-        return scroll_view
-
-        return scroll_view
+        relay_widget = RelayStatesWidget()
+        relay_widget.build_or_update(RelayDecoder()(relay_data))
+        return relay_widget
 
 if __name__ == "__main__":
     RelayApp().run()
@@ -0,0 +1,243 @@
+import math
+import operator
+import re
+
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+ALL_RELAYS = "RXX"
+MINUTES_PER_DAY = 24 * 60
+STEP_MINUTES = 1
+CHUNK_ROWS = 256  # commands scored at once by the numpy resolver
+
+# Arbitration order, a higher rank wins, on a tie the later command wins
+PRIORITY_RANKS = {"PLW": 0, **{f"P{i:02d}": i + 1 for i in range(10)}, "PHI": 11, "PTO": 12, "PTX": 13}
+STATE_VALUES = {"Closed": 0, "Opened": 1}
+NO_COMMAND = -1
+
+# Sensor driven types act on the first sensor whose name contains the word,
+# unless the description names the sensor itself ("soilMoisture_1<40")
+SENSOR_TYPES = {"ATemp": "temp", "AHumi": "humi", "AFlow": "flow", "AMost": "moist"}
+TIME_WINDOW = re.compile(r"^\s*(\d{1,2}):(\d{2})\s*-\s*(\d{1,2}):(\d{2})\s*$")
+SENSOR_CONDITION = re.compile(r"^\s*([A-Za-z_]\w*)?\s*(<=|>=|<|>)\s*(-?\d+(?:\.\d+)?)\s*$")
+COMPARISONS = {"<": operator.lt, "<=": operator.le, ">": operator.gt, ">=": operator.ge}
+
+
+class PreviewCommand:
+    __slots__ = ("raw", "type", "relay", "state", "rank", "description")
+
+    def __init__(self, raw, type, relay, state, rank, description):
+        self.raw = raw
+        self.type = type
+        self.relay = relay
+        self.state = state
+        self.rank = rank
+        self.description = description
+
+
+def parse_commands(commands, grammar=None):
+    """PreviewCommand for every command the preview understands, and the rest."""
+    parsed = []
+    skipped = []
+    for cmd in commands:
+        if grammar is not None:
+            try:
+                fields = grammar.parse(cmd)
+                type, relay, state, priority, description = (
+                    fields.type, fields.relay, fields.state, fields.priority, fields.description)
+            except ValueError:
+                skipped.append(cmd)
+                continue
+        else:
+            parts = cmd.split(";", 4)
+            if len(parts) < 4:
+                skipped.append(cmd)
+                continue
+            type, relay, state, priority = parts[:4]
+            description = parts[4] if len(parts) > 4 else ""
+        if state not in STATE_VALUES or priority not in PRIORITY_RANKS:
+            skipped.append(cmd)
+            continue
+        parsed.append(PreviewCommand(cmd, type, relay, STATE_VALUES[state],
+                                     PRIORITY_RANKS[priority], description.strip("; ")))
+    return parsed, skipped
+
+
+def time_window(description):
+    # (start, end) minutes of "HH:MM-HH:MM", end may be past midnight.
+    # 24:00 is the end of the day, equal start and end mean the whole day.
+    match = TIME_WINDOW.match(description)
+    if not match:
+        return None
+    h1, m1, h2, m2 = (int(group) for group in match.groups())
+    if h1 > 24 or h2 > 24 or m1 > 59 or m2 > 59 or (h1 == 24 and m1) or (h2 == 24 and m2):
+        return None
+    start = (h1 * 60 + m1) % MINUTES_PER_DAY
+    end = h2 * 60 + m2
+    if end != MINUTES_PER_DAY:
+        end %= MINUTES_PER_DAY
+    if start == end:
+        return 0, MINUTES_PER_DAY
+    return start, end
+
+
+def sensor_condition(command, sensors):
+    # True / False from the current sensor values, None if it cannot be told
+    match = SENSOR_CONDITION.match(command.description)
+    if not match:
+        return None
+    name, op, threshold = match.groups()
+    if name:
+        sample = sensors.get(name)
+    else:
+        word = SENSOR_TYPES[command.type]
+        sample = next((s for key, s in sensors.items() if word in key.lower()), None)
+    if sample is None:
+        return None
+    value = sample[1]
+    if isinstance(value, bool) or not isinstance(value, (int, float)) or math.isnan(value):
+        return None
+    return COMPARISONS[op](value, float(threshold))
+
+
+def activity(command, sensors):
+    """When the command applies on the timeline.
+
+    Returns True (always), False (never) or a (start, end) window for ATime.
+    """
+    if command.type == "ATime":
+        window = time_window(command.description)
+        return window if window is not None else False
+    if command.type in SENSOR_TYPES:
+        return bool(sensor_condition(command, sensors))
+    return True  # Manua and unknown types are not conditional
+
+
+class SchedulePreview:
+    # states: relay -> effective state per time step (STATE_VALUES or NO_COMMAND)
+    def __init__(self, relays, minutes, states, winners, commands, skipped):
+        self.relays = relays
+        self.minutes = minutes
+        self.states = states
+        self.winners = winners  # relay -> index into commands per step, -1 for none
+        self.commands = commands
+        self.skipped = skipped
+
+    def segments(self, relay):
+        # Runs of the same winning command: (start minute, end minute, state, command)
+        winners = self.winners[relay]
+        runs = []
+        if np is not None:
+            edges = np.flatnonzero(np.diff(winners)) + 1
+            starts = np.concatenate(([0], edges))
+            ends = np.concatenate((edges, [len(winners)]))
+            pairs = zip(starts.tolist(), ends.tolist())
+        else:
+            pairs = []
+            start = 0
+            for i in range(1, len(winners) + 1):
+                if i == len(winners) or winners[i] != winners[start]:
+                    pairs.append((start, i))
+                    start = i
+        for start, end in pairs:
+            index = int(winners[start])
+            command = self.commands[index] if index >= 0 else None
+            state = command.state if command else NO_COMMAND
+            runs.append((start * STEP_MINUTES, end * STEP_MINUTES, state, command))
+        return runs
+
+
+def preview_schedule(commands, relays, sensors=None, grammar=None, step=STEP_MINUTES):
+    """Resolves the priority arbitration of the command list over a 24h day.
+
+    Every command gets a score per time step, rank * count + position while it
+    applies and -1 otherwise, the highest score per relay is the winner.
+    Vectorized with numpy when it is installed.
+    """
+    sensors = sensors or {}
+    parsed, skipped = parse_commands(commands, grammar)
+    steps = MINUTES_PER_DAY // step
+    minutes = [i * step for i in range(steps)]
+    relays = list(relays)
+    if np is None:
+        winners = _resolve_python(parsed, relays, sensors, steps, step)
+    else:
+        winners = _resolve_numpy(parsed, relays, sensors, steps, step)
+    states = {}
+    if np is not None:
+        lookup = np.array([c.state for c in parsed] + [NO_COMMAND], dtype=np.int8)
+        for relay, relay_winners in winners.items():
+            states[relay] = lookup[relay_winners]  # -1 picks NO_COMMAND at the end
+    else:
+        for relay, relay_winners in winners.items():
+            states[relay] = [parsed[w].state if w >= 0 else NO_COMMAND for w in relay_winners]
+    return SchedulePreview(relays, minutes, states, winners, parsed, skipped)
+
+
+def _best_scores(starts, ends, score, rows, time):
+    # Highest score per time step of the given commands, -1 where none applies.
+    # CHUNK_ROWS commands at a time keep the commands x steps temporaries small.
+    best = np.full(len(time), -1, dtype=np.int32)
+    for i in range(0, len(rows), CHUNK_ROWS):
+        chunk = rows[i:i + CHUNK_ROWS]
+        start = starts[chunk, None]
+        end = ends[chunk, None]
+        # windows past midnight wrap around
+        inside = np.where(start <= end, (time >= start) & (time < end), (time >= start) | (time < end))
+        np.maximum(best, np.where(inside, score[chunk, None], np.int32(-1)).max(axis=0), out=best)
+    return best
+
+
+def _resolve_numpy(parsed, relays, sensors, steps, step):
+    count = len(parsed)
+    time = np.arange(steps, dtype=np.int32) * step
+    # Each active command as a window on the day, always = whole day
+    starts = np.zeros(count, dtype=np.int32)
+    ends = np.zeros(count, dtype=np.int32)
+    score = np.empty(count, dtype=np.int32)
+    rows_by_relay = {}
+    for i, command in enumerate(parsed):
+        active = activity(command, sensors)
+        if active is False:
+            continue
+        if active is True:
+            ends[i] = MINUTES_PER_DAY
+        else:
+            starts[i], ends[i] = active
+        score[i] = command.rank * (count + 1) + i
+        rows_by_relay.setdefault(command.relay, []).append(i)
+
+    # Best of the RXX commands, every relay competes against it
+    all_best = _best_scores(starts, ends, score, rows_by_relay.pop(ALL_RELAYS, []), time)
+    winners = {}
+    for relay in relays:
+        best = np.maximum(_best_scores(starts, ends, score, rows_by_relay.get(relay, []), time), all_best)
+        winners[relay] = np.where(best >= 0, best % (count + 1), -1)
+    return winners
+
+
+def _resolve_python(parsed, relays, sensors, steps, step):
+    count = len(parsed)
+    applies = []
+    for i, command in enumerate(parsed):
+        applies.append((command, command.rank * (count + 1) + i, activity(command, sensors)))
+    winners = {}
+    for relay in relays:
+        candidates = [a for a in applies if a[0].relay in (relay, ALL_RELAYS) and a[2] is not False]
+        relay_winners = []
+        for t in range(steps):
+            minute = t * step
+            best = -1
+            for command, score, active in candidates:
+                if active is not True:
+                    start, end = active
+                    inside = start <= minute < end if start <= end else (minute >= start or minute < end)
+                    if not inside:
+                        continue
+                if score > best:
+                    best = score
+            relay_winners.append(best % (count + 1) if best >= 0 else -1)
+        winners[relay] = relay_winners
+    return winners
@@ -0,0 +1,139 @@
+import time
+
+from kivy.core.text import Label as CoreLabel
+from kivy.graphics import Color, InstructionGroup, Rectangle
+from kivy.metrics import dp, sp
+from kivy.uix.recycleboxlayout import RecycleBoxLayout
+from kivy.uix.recycleview import RecycleView
+from kivy.uix.recycleview.views import RecycleDataViewBehavior
+from kivy.uix.widget import Widget
+from kivymd.app import MDApp
+from kivymd.uix.boxlayout import MDBoxLayout
+from kivymd.uix.label import MDLabel
+from kivymd.uix.screen import MDScreen
+
+from SchedulePreview import MINUTES_PER_DAY, NO_COMMAND, preview_schedule
+
+ROW_HEIGHT = 30
+LABEL_RATIO = 0.1
+STATE_COLORS = {
+    1: (0.30, 0.69, 0.31, 1),  # Opened
+    0: (0.90, 0.30, 0.24, 1),  # Closed
+    NO_COMMAND: (0.85, 0.85, 0.85, 1),
+}
+TEXT_COLOR = (0, 0, 0, 0.87)
+AXIS_HOURS = (0, 6, 12, 18)
+
+
+class ScheduleRow(RecycleDataViewBehavior, Widget):
+    # Recycled timeline of one relay, data: {"relay": str, "segments": [(start, end, state), ...]}
+    textures = {}
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+        self.relay = ""
+        self.segments = ()
+        self.__segments = InstructionGroup()
+        with self.canvas:
+            Color(*TEXT_COLOR)
+            self.__label = Rectangle()
+        self.canvas.add(self.__segments)
+        self.bind(pos=self._layout, size=self._layout)
+
+    def refresh_view_attrs(self, rv, index, data):
+        self.relay = data["relay"]
+        self.segments = data["segments"]
+        self.__label.texture = self._render_text(self.relay)
+        super().refresh_view_attrs(rv, index, data)
+        self._layout()
+
+    @classmethod
+    def _render_text(cls, text):
+        # A handful of relay ids, render each once for all rows
+        texture = cls.textures.get(text)
+        if texture is None:
+            label = CoreLabel(text=text, font_size=sp(14))
+            label.refresh()
+            texture = cls.textures[text] = label.texture
+        return texture
+
+    def _layout(self, *args):
+        label_width = self.width * LABEL_RATIO
+        text_w, text_h = self.__label.texture.size if self.__label.texture else (0, 0)
+        self.__label.pos = (self.x + dp(5), self.y + (self.height - text_h) / 2)
+        self.__label.size = (text_w, text_h)
+
+        x0 = self.x + label_width
+        scale = (self.width - label_width) / MINUTES_PER_DAY
+        group = self.__segments
+        group.clear()
+        for start, end, state in self.segments:
+            group.add(Color(*STATE_COLORS[state]))
+            group.add(Rectangle(pos=(x0 + start * scale, self.y + dp(3)),
+                                size=((end - start) * scale, self.height - dp(6))))
+
+
+class SchedulePreviewWidget(MDBoxLayout):
+    def __init__(self, **kwargs):
+        super().__init__(orientation="vertical", padding=dp(10), spacing=dp(5), **kwargs)
+        self.preview = None
+
+        self.summary = MDLabel(size_hint_y=None, height=dp(30), theme_text_color="Secondary")
+        self.add_widget(self.summary)
+
+        axis = MDBoxLayout(orientation="horizontal", size_hint_y=None, height=dp(20))
+        axis.add_widget(Widget(size_hint_x=LABEL_RATIO))
+        for hour in AXIS_HOURS:
+            axis.add_widget(MDLabel(text=f"{hour:02d}:00", font_style="Caption",
+                                    size_hint_x=(1 - LABEL_RATIO) / len(AXIS_HOURS)))
+        self.add_widget(axis)
+
+        rows = RecycleBoxLayout(
+            orientation="vertical",
+            spacing=dp(2),
+            default_size=(None, dp(ROW_HEIGHT)),
+            default_size_hint=(1, None),
+            size_hint_y=None,
+        )
+        rows.bind(minimum_height=rows.setter("height"))
+        self.schedule_view = RecycleView(size_hint_y=1)
+        self.schedule_view.viewclass = ScheduleRow
+        self.schedule_view.add_widget(rows)
+        self.add_widget(self.schedule_view)
+
+    def update(self, commands, relays, sensors=None, grammar=None):
+        start = time.perf_counter()
+        self.preview = preview = preview_schedule(commands, relays, sensors, grammar)
+        elapsed = time.perf_counter() - start
+        self.schedule_view.data = [
+            {"relay": relay,
+             "segments": [(begin, end, state) for begin, end, state, _ in preview.segments(relay)]}
+            for relay in preview.relays
+        ]
+        skipped = f", {len(preview.skipped)} not understood" if preview.skipped else ""
+        self.summary.text = (f"{len(preview.commands)} commands on {len(preview.relays)} relays"
+                             f"{skipped}, resolved in {elapsed * 1000:.0f} ms")
+
+
+command_list = [
+    "Manua;RXX;Closed;P00;F",
+    "ATime;R09;Opened;P07;06:00-07:30",
+    "ATime;R02;Opened;P01;23:00-01:00",
+    "Manua;R03;Opened;PTO;",
+    "ATemp;R04;Opened;P02;>20",
+]
+
+
+class SchedulePreviewApp(MDApp):
+    def build(self):
+        self.theme_cls.primary_palette = "BlueGray"
+        screen = MDScreen()
+        widget = SchedulePreviewWidget()
+        widget.update(command_list, [f"R{i:02d}" for i in range(1, 17)],
+                      {"externalTemp_C": (None, 25.3)})
+        screen.add_widget(widget)
+        return screen
+
+
+if __name__ == "__main__":
+    SchedulePreviewApp().run()
@@ -0,0 +1,42 @@
+class ScreenGate:
+    """Holds back StateStore notifications for a screen that is not shown.
+
+    While hidden, updates are collapsed into the latest state: keyed updates
+    (lists of changed relays / sensors) are merged per key, anything else
+    keeps the last value. show() applies what is pending once.
+    """
+
+    def __init__(self, visible=False):
+        self.visible = visible
+        self.__pending = {}
+        self.deferred = 0
+        self.flushed = 0
+
+    def wrap(self, callback, key=None):
+        # key: item -> key for notifications that carry a list of changed items
+        def gated(value):
+            if self.visible:
+                callback(value)
+                return
+            self.deferred += 1
+            if key is None:
+                self.__pending[gated] = (callback, False, value)
+                return
+            merged = self.__pending.setdefault(gated, (callback, True, {}))[2]
+            for item in value:
+                merged[key(item)] = item
+        return gated
+
+    def show(self):
+        self.visible = True
+        # dicts keep insertion order, so subscribers are flushed in notification order
+        pending, self.__pending = self.__pending, {}
+        for callback, keyed, value in pending.values():
+            self.flushed += 1
+            callback(list(value.values()) if keyed else value)
+
+    def hide(self):
+        self.visible = False
+
+    def stats(self):
+        return {"deferred": self.deferred, "flushed": self.flushed}
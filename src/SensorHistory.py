@@ -0,0 +1,111 @@
+import math
+from array import array
+
+HISTORY_CAPACITY = 3600
+
+
+class RingBuffer:
+    """Fixed capacity float buffer, the oldest sample is overwritten when full."""
+
+    def __init__(self, capacity=HISTORY_CAPACITY):
+        self.capacity = capacity
+        self.__data = array("d", bytes(8 * capacity))
+        self.__next = 0
+        self.__count = 0
+        self.total = 0  # samples appended so far, including overwritten ones
+
+    def __len__(self):
+        return self.__count
+
+    def append(self, value):
+        self.__data[self.__next] = value
+        self.total += 1
+        self.__next = (self.__next + 1) % self.capacity
+        if self.__count < self.capacity:
+            self.__count += 1
+
+    def values(self):
+        # Samples in chronological order
+        if self.__count < self.capacity:
+            return self.__data[:self.__count]
+        return self.__data[self.__next:] + self.__data[:self.__next]
+
+    def last(self):
+        if self.__count == 0:
+            return math.nan
+        return self.__data[self.__next - 1]
+
+
+def to_sample(value):
+    if isinstance(value, bool):
+        return 1.0 if value else 0.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    return math.nan
+
+
+def downsample_min_max(values, buckets):
+    """Reduce values to at most 2 * buckets points keeping each bucket's extremes.
+
+    Returns (index, value) pairs in chronological order, NaN samples are left out.
+    """
+    count = len(values)
+    if count <= 2 * buckets:
+        return [(i, v) for i, v in enumerate(values) if not math.isnan(v)]
+
+    points = []
+    for bucket in range(buckets):
+        start = bucket * count // buckets
+        end = (bucket + 1) * count // buckets
+        lo_i = hi_i = -1
+        lo = math.inf
+        hi = -math.inf
+        for i in range(start, end):
+            v = values[i]
+            if v < lo:
+                lo, lo_i = v, i
+            if v > hi:
+                hi, hi_i = v, i
+        if lo_i < 0:
+            continue  # only NaN in this bucket
+        if lo_i == hi_i:
+            points.append((lo_i, lo))
+        elif lo_i < hi_i:
+            points.append((lo_i, lo))
+            points.append((hi_i, hi))
+        else:
+            points.append((hi_i, hi))
+            points.append((lo_i, lo))
+    return points
+
+
+def sparkline_points(values, x, y, width, height):
+    """Flat Line() point list for values fitted into the given box, one bucket per pixel."""
+    if width <= 0 or height <= 0:
+        return []
+    samples = downsample_min_max(values, max(int(width), 1))
+    if len(samples) < 2:
+        return []
+    lo = min(v for _, v in samples)
+    hi = max(v for _, v in samples)
+    span = hi - lo or 1.0
+    last_index = max(len(values) - 1, 1)
+    points = []
+    for i, v in samples:
+        points.append(x + width * i / last_index)
+        points.append(y + height * (v - lo) / span)
+    return points
+
+
+class SensorHistory:
+    def __init__(self, capacity=HISTORY_CAPACITY):
+        self.capacity = capacity
+        self.buffers = {}
+
+    def append(self, key, value):
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = RingBuffer(self.capacity)
+            self.buffers[key] = buffer
+        buffer.append(to_sample(value))
+        return buffer
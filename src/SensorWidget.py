@@ -1,70 +1,140 @@
 import json
 
-from kivy.metrics import dp
+from kivy.core.text import Label as CoreLabel
+from kivy.clock import Clock
+from kivy.graphics import Color, Line, Rectangle
+from kivy.metrics import dp, sp
 from kivy.uix.scrollview import ScrollView
+from kivy.uix.widget import Widget
 from kivymd.app import MDApp
 from kivymd.uix.boxlayout import MDBoxLayout
-from kivymd.uix.card import MDCard
-from kivymd.uix.label import MDLabel
 from kivymd.uix.screen import MDScreen
 
+from DirtyFields import RenderCache
+from MessageModels import SensorDecoder
+from SensorHistory import SensorHistory, sparkline_points
+
+# name, value, unit, sparkline
+CELL_RATIOS = (0.3, 0.2, 0.2, 0.3)
+CELL_BG_COLOR = (0.95, 0.95, 0.95, 1)
+CELL_TEXT_COLOR = (0, 0, 0, 0.87)
+SPARKLINE_COLOR = (0.29, 0.56, 0.89, 1)
+SPARKLINE_REFRESH_INTERVAL = 1.0
+
+
+class SensorRow(Widget):
+    # One widget per sensor row: the name, value and unit cells are drawn
+    # straight on the canvas instead of an MDCard + MDLabel per cell.
+    def __init__(self, name, value, unit, **kwargs):
+        super().__init__(size_hint_y=None, height=dp(40), **kwargs)
+        self.__texts = [name, value, unit]
+        self.__backgrounds = []
+        self.__labels = []
+        self.history = None
+        self.drawn_total = 0
+        with self.canvas:
+            Color(*CELL_BG_COLOR)
+            for _ in CELL_RATIOS:
+                self.__backgrounds.append(Rectangle())
+            Color(*CELL_TEXT_COLOR)
+            for text in self.__texts:
+                self.__labels.append(Rectangle(texture=self._render_text(text)))
+            Color(*SPARKLINE_COLOR)
+            self.__sparkline = Line(width=1)
+        self.bind(pos=self._layout, size=self._layout)
+
+    @property
+    def text(self):
+        return self.__texts[1]
+
+    @text.setter
+    def text(self, value):
+        # Only the value cell changes after creation
+        self.__texts[1] = value
+        self.__labels[1].texture = self._render_text(value)
+        self._layout()
+
+    def _render_text(self, text):
+        label = CoreLabel(text=text, font_size=sp(16))
+        label.refresh()
+        return label.texture
+
+    def refresh_sparkline(self):
+        if self.history is None:
+            return
+        background = self.__backgrounds[-1]
+        padding = dp(5)
+        x, y = background.pos
+        width, height = background.size
+        self.drawn_total = self.history.total
+        # One min/max bucket per pixel, so the cost depends on the cell width only
+        self.__sparkline.points = sparkline_points(
+            self.history.values(), x + padding, y + padding, width - 2 * padding, height - 2 * padding
+        )
+
+    def _layout(self, *args):
+        spacing = dp(5)
+        padding = dp(5)
+        usable = self.width - spacing * (len(CELL_RATIOS) - 1)
+        x = self.x
+        for background, ratio in zip(self.__backgrounds, CELL_RATIOS):
+            width = usable * ratio
+            background.pos = (x, self.y)
+            background.size = (width, self.height)
+            x += width + spacing
+        for background, label in zip(self.__backgrounds, self.__labels):
+            text_w, text_h = label.texture.size if label.texture else (0, 0)
+            label.pos = (background.pos[0] + padding, self.y + (self.height - text_h) / 2)
+            label.size = (text_w, text_h)
+        self.refresh_sparkline()
+
 
 class SensorWidget(MDBoxLayout):
-    def __init__(self, **kwargs):
+    def __init__(self, history=None, **kwargs):
         super().__init__(orientation="vertical", padding=dp(10), spacing=dp(10), **kwargs)
         self.labels = {}
+        self.rendered = RenderCache()
+        # Filled by the owner of the data (StateStore), the widget only reads it
+        self.history = history if history is not None else SensorHistory()
+        Clock.schedule_interval(self._refresh_sparklines, SPARKLINE_REFRESH_INTERVAL)
         self.scroll = ScrollView()
         self.content = MDBoxLayout(orientation="vertical", spacing=dp(5), size_hint_y=None)
         self.content.bind(minimum_height=self.content.setter("height"))
         self.scroll.add_widget(self.content)
         self.add_widget(self.scroll)
 
-    def update_data(self, data: dict):
-        for key, value in data.items():
-            if isinstance(value, list):
-                for i, item in enumerate(value):
-                    label_key = f"{key}_{i}"
-                    self._add_or_update_row(label_key, item)
-            else:
-                self._add_or_update_row(key, value)
+    def update_data(self, samples):
+        # samples: (MessageModels.SensorKey, value) pairs, name/unit are precomputed per key
+        for sensor_key, value in samples:
+            self._add_or_update_row(sensor_key, value)
 
-    def _add_or_update_row(self, key, value):
-        name, unit = self._extract_name_and_unit(key)
-
-        if key not in self.labels:
-            row = MDBoxLayout(orientation="horizontal", spacing=dp(5), size_hint_y=None, height=dp(40))
+    def update_stats(self):
+        return self.rendered.counter.stats()
 
-            name_card = self._build_cell(name, 0.4)
-            value_card = self._build_cell(self._format_value(value), 0.3)
-            unit_card = self._build_cell(unit, 0.3)
+    def _refresh_sparklines(self, dt):
+        # Screens that are not shown are out of the window, nothing to draw then
+        if self.get_parent_window() is None:
+            return
+        # Redraw rows whose history got new samples, even if the value stayed the same
+        for key, row in self.labels.items():
+            if row.history is None:
+                row.history = self.history.buffers.get(key)
+            if row.history is not None and row.history.total != row.drawn_total:
+                row.refresh_sparkline()
 
-            self.labels[key] = value_card.children[0]  # MDLabel inside the card
+    def _add_or_update_row(self, sensor_key, value):
+        key = sensor_key.key
+        text = self._format_value(value)
+        if not self.rendered.changed(key, text):
+            return
 
-            row.add_widget(name_card)
-            row.add_widget(value_card)
-            row.add_widget(unit_card)
+        if key not in self.labels:
+            row = SensorRow(sensor_key.name, text, sensor_key.unit)
+            row.history = self.history.buffers.get(key)
+            self.labels[key] = row
             self.content.add_widget(row)
         else:
-            self.labels[key].text = self._format_value(value)
-
-    def _build_cell(self, text, width_ratio):
-        card = MDCard(
-            padding=dp(5),
-            radius=[0],
-            style="filled",
-            md_bg_color=(0.95, 0.95, 0.95, 1),
-            size_hint_x=width_ratio,
-        )
-        label = MDLabel(text=text, halign="left", valign="middle")
-        label.bind(size=label.setter("text_size"))
-        card.add_widget(label)
-        return card
-
-    def _extract_name_and_unit(self, key: str):
-        if "_" in key:
-            parts = key.split("_", 1)
-            return parts[0], parts[1]
-        return key, ""
+            self.labels[key].text = text
 
     def _format_value(self, value):
         if isinstance(value, float):
@@ -90,8 +160,8 @@ if __name__ == "__main__":
                 "soilMoisture": [45.3, 50.2, float('nan')],
                 "valid": True
             }
-            widget = SensorDataWidget()
-            widget.update_data(sensor_data)
+            widget = SensorWidget()
+            widget.update_data(SensorDecoder()(sensor_data).samples)
             screen.add_widget(widget)
             return screen
 
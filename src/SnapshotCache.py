@@ -0,0 +1,83 @@
+import json
+import os
+import threading
+
+SNAPSHOT_PATH = "../cache/snapshot.json"
+SNAPSHOT_TOPIC_KEYS = ("CMD_OPTIONS", "CMD_LIST", "RELAYS", "SENSORS")
+WRITE_INTERVAL = 5.0
+
+
+def to_payload(value):
+    # Back to the JSON shape the controller sends, see MessageModels
+    if value is None:
+        return None
+    if isinstance(value, list):
+        return {record.relay: record.to_payload() for record in value}
+    if hasattr(value, "to_payload"):
+        return value.to_payload()
+    return value
+
+
+class SnapshotCache:
+    """Last payload of each snapshot topic, saved so the UI can start from it.
+
+    update() only keeps a reference, a background thread serialises and
+    atomically replaces the file at most every WRITE_INTERVAL seconds.
+    """
+
+    def __init__(self, path=SNAPSHOT_PATH, write_interval=WRITE_INTERVAL):
+        self.path = path
+        self.write_interval = write_interval
+        self.__lock = threading.Lock()
+        self.__latest = {}
+        self.__dirty = threading.Event()
+        self.__stop = threading.Event()
+        self.__thread = threading.Thread(target=self._writer_loop, name="SnapshotCache", daemon=True)
+        self.__thread.start()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError) as e:
+            if not isinstance(e, FileNotFoundError):
+                print(f"Ignoring broken snapshot {self.path}. Error: {e}")
+            return {}
+        with self.__lock:
+            for key, payload in data.items():
+                self.__latest.setdefault(key, payload)
+        return data
+
+    # Called from the MQTT thread with the decoded value of a topic
+    def update(self, topic_key, value):
+        with self.__lock:
+            self.__latest[topic_key] = value
+        self.__dirty.set()
+
+    def close(self):
+        # Writes what is still pending before returning
+        self.__stop.set()
+        self.__thread.join()
+
+    def _writer_loop(self):
+        while not self.__stop.is_set():
+            # Collapse bursts of updates into one write per interval
+            self.__stop.wait(self.write_interval)
+            if self.__dirty.is_set():
+                self.__dirty.clear()
+                try:
+                    self._write()
+                except Exception as e:
+                    print(f"SnapshotCache: failed to write {self.path}. Error: {e}")
+
+    def _write(self):
+        with self.__lock:
+            latest = dict(self.__latest)
+        data = {key: to_payload(value) for key, value in latest.items()}
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = self.path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,73 @@
+import builtins
+import os
+import sys
+import time
+
+# SJIRS_PROFILE_STARTUP=1 prints import times and time-to-first-frame
+PROFILE_ENV = "SJIRS_PROFILE_STARTUP"
+REPORT_TOP_IMPORTS = 15
+
+
+class StartupProfiler:
+    """Times first imports and startup milestones until the first frame is drawn.
+
+    Import times are inclusive (a module's own imports count towards it), only
+    modules that are imported from the top level of the tree are reported.
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.enabled = False
+        self.marks = []
+        self.imports = []
+        self.__depth = 0
+        self.__original_import = None
+
+    def enable(self):
+        if self.enabled:
+            return
+        self.enabled = True
+        self.__original_import = builtins.__import__
+        builtins.__import__ = self._timed_import
+
+    def _timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        if level == 0 and name in sys.modules:
+            return self.__original_import(name, globals, locals, fromlist, level)
+        self.__depth += 1
+        start = time.perf_counter()
+        try:
+            return self.__original_import(name, globals, locals, fromlist, level)
+        finally:
+            self.__depth -= 1
+            if self.__depth == 0:
+                self.imports.append((time.perf_counter() - start, name))
+
+    def mark(self, name):
+        if self.enabled:
+            self.marks.append((name, time.perf_counter() - self.start))
+
+    def watch_first_frame(self, window):
+        if not self.enabled:
+            return
+
+        def on_flip(*args):
+            window.unbind(on_flip=on_flip)
+            self.mark("first frame")
+            self.finish()
+
+        window.bind(on_flip=on_flip)
+
+    def finish(self):
+        builtins.__import__ = self.__original_import
+        print("Startup profile:")
+        for name, elapsed in self.marks:
+            print(f"  {elapsed * 1000:9.1f} ms  {name}")
+        total = sum(elapsed for elapsed, _ in self.imports)
+        print(f"Top level imports: {total * 1000:.1f} ms in total, slowest:")
+        for elapsed, name in sorted(self.imports, reverse=True)[:REPORT_TOP_IMPORTS]:
+            print(f"  {elapsed * 1000:9.1f} ms  {name}")
+
+
+startup_profiler = StartupProfiler()
+if os.environ.get(PROFILE_ENV):
+    startup_profiler.enable()
@@ -0,0 +1,127 @@
+from SensorHistory import SensorHistory
+
+RELAYS = "relays"
+SENSORS = "sensors"
+CMD_OPTIONS = "cmd_options"
+CMD_LIST = "cmd_list"
+LOCAL_TIME = "local_time"
+# Set of fields that still show cached data, see mark_stale()
+STALE = "stale"
+FIELDS = (RELAYS, SENSORS, CMD_OPTIONS, CMD_LIST, LOCAL_TIME, STALE)
+
+
+class StateStore:
+    """Single owner of the decoded controller state, used from the UI thread only.
+
+    Views subscribe to the fields they render and are called only when that
+    field changed. For RELAYS and SENSORS the callback gets just the changed
+    items (RelayRecords / (SensorKey, value) pairs), the other fields pass the
+    new value.
+    """
+
+    def __init__(self):
+        self.relays = {}
+        self.sensors = {}
+        self.cmd_options = None
+        self.cmd_list = None
+        self.local_time = None
+        self.stale = set()
+        self.sensor_history = SensorHistory()
+        self.__subscribers = {field: [] for field in FIELDS}
+
+    def subscribe(self, field, callback, replay=True):
+        # replay: call back right away with the current state, if there is any
+        self.__subscribers[field].append(callback)
+        if replay:
+            current = self.current(field)
+            if current:
+                callback(current)
+
+    def unsubscribe(self, field, callback):
+        if callback in self.__subscribers[field]:
+            self.__subscribers[field].remove(callback)
+
+    def current(self, field):
+        if field == RELAYS:
+            return list(self.relays.values())
+        if field == SENSORS:
+            return list(self.sensors.values())
+        return getattr(self, field)
+
+    def mark_stale(self, fields):
+        # The current values of these fields came from a cache, not the controller
+        if not fields:
+            return
+        self.stale |= set(fields)
+        self._notify(STALE, set(self.stale))
+
+    def relay_state(self, relay):
+        record = self.relays.get(relay)
+        return record.state if record else ""
+
+    def apply_relays(self, records):
+        changed = []
+        for record in records:
+            old = self.relays.get(record.relay)
+            if (old is None or old.state != record.state or old.cmd != record.cmd
+                    or old.priority != record.priority):
+                self.relays[record.relay] = record
+                changed.append(record)
+        self._fresh(RELAYS)
+        if changed:
+            self._notify(RELAYS, changed)
+
+    def apply_sensors(self, snapshot):
+        changed = []
+        history = self.sensor_history
+        for sample in snapshot.samples:
+            sensor_key, value = sample
+            # History keeps every sample, notifications only the changed ones
+            history.append(sensor_key.key, value)
+            old = self.sensors.get(sensor_key.key)
+            if old is None or not self._same_value(old[1], value):
+                self.sensors[sensor_key.key] = sample
+                changed.append(sample)
+        self._fresh(SENSORS)
+        if changed:
+            self._notify(SENSORS, changed)
+
+    def apply_cmd_options(self, options):
+        self._set(CMD_OPTIONS, options)
+
+    def apply_cmd_list(self, command_list):
+        self._fresh(CMD_LIST)
+        if command_list is not None and self.cmd_list is not None \
+                and command_list.commands == self.cmd_list.commands:
+            return
+        self.cmd_list = command_list
+        self._notify(CMD_LIST, command_list)
+
+    def apply_local_time(self, local_time):
+        self._set(LOCAL_TIME, local_time)
+
+    def _set(self, field, value):
+        self._fresh(field)
+        if getattr(self, field) == value:
+            return
+        setattr(self, field, value)
+        self._notify(field, value)
+
+    def _fresh(self, field):
+        # Fresh data arrived, even if it is identical to the cached one
+        if field in self.stale:
+            self.stale.discard(field)
+            self._notify(STALE, set(self.stale))
+
+    def _same_value(self, old, new):
+        # nan != nan, but an unchanged nan reading is no change
+        if type(old) is not type(new):
+            return False
+        return old == new or (old != old and new != new)
+
+    def _notify(self, field, value):
+        for callback in list(self.__subscribers[field]):
+            try:
+                callback(value)
+            except Exception as e:
+                print(f"StateStore: {field} subscriber failed. Error: {e}")
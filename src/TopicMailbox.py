@@ -0,0 +1,71 @@
+import threading
+from collections import deque
+
+
+class TopicMailbox:
+    """Per-topic mailbox between the MQTT thread and the UI thread.
+
+    By default only the newest payload of a topic is kept ("latest wins"), so a
+    burst of RELAYS/SENSORS snapshots costs one widget update per frame. Topics
+    registered with keep_all=True queue every payload instead (CMD_RESPONSE).
+    """
+
+    def __init__(self, schedule_drain=None):
+        self.__lock = threading.Lock()
+        self.__callbacks = {}
+        self.__keep_all = set()
+        self.__latest = {}
+        self.__queued = {}
+        self.__schedule_drain = schedule_drain
+        self.dropped = {}
+        self.delivered = {}
+
+    def register(self, topic, callback, keep_all=False):
+        self.__callbacks[topic] = callback
+        self.dropped.setdefault(topic, 0)
+        self.delivered.setdefault(topic, 0)
+        if keep_all:
+            self.__keep_all.add(topic)
+        else:
+            self.__keep_all.discard(topic)
+
+    # Can be called from any thread
+    def post(self, topic, payload):
+        with self.__lock:
+            if topic in self.__keep_all:
+                self.__queued.setdefault(topic, deque()).append(payload)
+            else:
+                if topic in self.__latest:
+                    self.dropped[topic] = self.dropped.get(topic, 0) + 1
+                self.__latest[topic] = payload
+        if self.__schedule_drain:
+            self.__schedule_drain()
+
+    # Must be called on the UI thread, at most once per frame
+    def drain(self, *args):
+        with self.__lock:
+            latest, self.__latest = self.__latest, {}
+            queued, self.__queued = self.__queued, {}
+
+        for topic, payload in latest.items():
+            self.__deliver(topic, payload)
+        for topic, payloads in queued.items():
+            for payload in payloads:
+                self.__deliver(topic, payload)
+
+    def stats(self):
+        return {
+            topic: {"delivered": self.delivered.get(topic, 0), "dropped": self.dropped.get(topic, 0)}
+            for topic in self.__callbacks
+        }
+
+    def __deliver(self, topic, payload):
+        callback = self.__callbacks.get(topic)
+        if callback is None:
+            print(f"Mailbox: no callback for {topic}")
+            return
+        self.delivered[topic] = self.delivered.get(topic, 0) + 1
+        try:
+            callback(payload)
+        except Exception as e:
+            print(f"Mailbox: callback for {topic} failed. Error: {e}")
@@ -1,95 +1,266 @@
+# Must come first, it times every import below when SJIRS_PROFILE_STARTUP is set
+from StartupProfiler import startup_profiler
+
+import os
+
 from kivy.clock import Clock
-from kivy.lang import Builder
-from kivy.uix.boxlayout import BoxLayout
 from kivy.uix.screenmanager import NoTransition
-from kivy.uix.widget import Widget
 from kivymd.app import MDApp
 from kivymd.uix.boxlayout import BoxLayout
-from kivymd.uix.button import MDRaisedButton
-from kivymd.uix.gridlayout import MDGridLayout
 from kivymd.uix.label import MDLabel
 from kivymd.uix.list import IconLeftWidget, OneLineIconListItem
 from kivymd.uix.navigationdrawer import MDNavigationDrawer, MDNavigationLayout
 from kivymd.uix.screen import MDScreen
 from kivymd.uix.screenmanager import MDScreenManager
-from kivymd.uix.scrollview import MDScrollView
-from kivymd.uix.textfield import MDTextField
 from kivymd.uix.toolbar import MDTopAppBar
 
-from CommandWidget import CommandWidget
+from HistoryStore import HistoryStore
 from MQTTClient import MQTTClient
-from MqttSettingsWidget import MQTTSettingsWidget
-from RelayStatesWidget import RelayStatesWidget
-from SensorWidget import SensorWidget
+from ScreenGate import ScreenGate
+from SnapshotCache import SNAPSHOT_TOPIC_KEYS, SnapshotCache
+import StateStore
+from TopicMailbox import TopicMailbox
+
+# The widget modules are imported when their screen is first shown
+startup_profiler.mark("imports done")
+
+
+# Record incoming traffic to a capture file / replay a capture instead of a broker
+CAPTURE_PATH_ENV = "SJIRS_CAPTURE"
+REPLAY_PATH_ENV = "SJIRS_REPLAY"
+REPLAY_SPEED_ENV = "SJIRS_REPLAY_SPEED"  # 1 = real time, N = N times faster, 0 = as fast as possible
+# "asyncio" runs MQTT on the app's event loop instead of a network thread
+MQTT_TRANSPORT_ENV = "SJIRS_MQTT_TRANSPORT"
+# Receive and decode MQTT traffic in a child process, see IngestProcess
+INGEST_PROCESS_ENV = "SJIRS_INGEST_PROCESS"
+# Talk to LocalController on an in-process broker instead of a real controller
+LOCAL_CONTROLLER_ENV = "SJIRS_LOCAL_CONTROLLER"
+
+SCREEN_NAMES = ("mqtt", "commands", "relay", "sensors", "schedule")
+# Store fields rendered by each screen, used to flag cached (stale) data
+SCREEN_FIELDS = {
+    "mqtt": (StateStore.LOCAL_TIME,),
+    "commands": (StateStore.CMD_OPTIONS, StateStore.CMD_LIST),
+    "relay": (StateStore.RELAYS,),
+    "sensors": (StateStore.SENSORS,),
+    "schedule": (StateStore.CMD_OPTIONS, StateStore.CMD_LIST, StateStore.SENSORS),
+}
+APP_TITLE = "Irrigation System"
 
 
-class MainScreen(MDScreen):
-    def __init__(self, **kwargs):
+class MainApp(MDApp):
+    def __init__(self, mqtt_client=None, history_store=None, snapshot_cache=None, **kwargs):
         super().__init__(**kwargs)
+        self.local_controller = None
+        if mqtt_client is None and os.environ.get(LOCAL_CONTROLLER_ENV):
+            from LocalBroker import LocalBroker, LocalClient
+            from LocalController import LocalController
+
+            broker = LocalBroker()
+            self.local_controller = LocalController(broker)
+            mqtt_client = MQTTClient(self.on_connect, LocalClient(broker))
+        elif mqtt_client is None and os.environ.get(INGEST_PROCESS_ENV):
+            from IngestProcess import IngestProcessClient
+
+            mqtt_client = IngestProcessClient(self.on_connect)
+        elif mqtt_client is None:
+            mqtt_client = MQTTClient(self.on_connect, transport=os.environ.get(MQTT_TRANSPORT_ENV, "thread"))
+        self.mqtt_client = mqtt_client
+        # Latest payload per topic, drained at most once per frame
+        self.mailbox = TopicMailbox(Clock.create_trigger(lambda dt: self.mailbox.drain()))
+        # The ingest process records history itself, it sees every message
+        if history_store is None and not self.mqtt_client.records_history:
+            history_store = HistoryStore()
+        self.history_store = history_store
+        self.store = StateStore.StateStore()
+        # Updates for hidden screens are collapsed and applied when they are shown
+        self.screen_gates = {name: ScreenGate() for name in SCREEN_NAMES}
+        self.snapshot_cache = snapshot_cache if snapshot_cache is not None else SnapshotCache()
+        self.load_snapshot()
+        if os.environ.get(CAPTURE_PATH_ENV):
+            self.mqtt_client.start_capture(os.environ[CAPTURE_PATH_ENV])
 
-        # Add the MQTT layout to the main layout
-        self.mqttSettingsWidget = MQTTSettingsWidget()
-        self.main_layout.add_widget(self.mqttSettingsWidget)
+    def on_connect(self, client, userdata, flags, rc):     
+        self.mqttSettingsWidget.on_connect(client, userdata, flags, rc)
 
-        # Add the command widget
-        self.commandWidget = CommandWidget(self.mqtt_client.commandManager)
-        self.main_layout.add_widget(self.commandWidget)
+    def store_appliers(self):
+        return {
+            "LOCAL_TIME": self.store.apply_local_time,
+            "CMD_OPTIONS": self.store.apply_cmd_options,
+            "CMD_LIST": self.store.apply_cmd_list,
+            "RELAYS": self.store.apply_relays,
+            "SENSORS": self.store.apply_sensors,
+        }
+
+    def load_snapshot(self):
+        # Render the last known state until the controller answers
+        appliers = self.store_appliers()
+        fields = {"CMD_OPTIONS": StateStore.CMD_OPTIONS, "CMD_LIST": StateStore.CMD_LIST,
+                  "RELAYS": StateStore.RELAYS, "SENSORS": StateStore.SENSORS}
+        stale = set()
+        for topic_key, payload in self.snapshot_cache.load().items():
+            if topic_key not in fields or payload is None:
+                continue
+            model = self.mqtt_client.models.get(self.mqtt_client.SUB_TOPICS[topic_key])
+            try:
+                appliers[topic_key](model(payload) if model else payload)
+            except ValueError as e:
+                print(f"Ignoring cached {topic_key}. Error: {e}")
+                continue
+            stale.add(fields[topic_key])
+        self.store.mark_stale(stale)
+
+    def add_cb(self, topic_key, callback, call_on_main_thread=True, keep_all=False, recorders=()):
+        topic = self.mqtt_client.SUB_TOPICS[topic_key]
+        if False == call_on_main_thread:
+            self.mqttTopicCallbacks[topic] = callback
+            return
+        self.mailbox.register(topic, callback, keep_all)
+        if not recorders:
+            self.mqttTopicCallbacks[topic] = lambda payload, t=topic: self.mailbox.post(t, payload)
+            return
 
-        # Add the relay state widget
-        self.relayStateWidget = RelayStatesWidget(self.toggle_hd)
-        self.main_layout.add_widget(self.relayStateWidget)
+        # Record every payload before the mailbox coalesces them
+        def record_and_post(payload, t=topic):
+            for recorder in recorders:
+                recorder(payload)
+            self.mailbox.post(t, payload)
+        self.mqttTopicCallbacks[topic] = record_and_post
 
-        # Add the main layout to the screen
-        self.add_widget(self.main_layout)
+    def snapshot_recorder(self, topic_key):
+        return lambda payload: self.snapshot_cache.update(topic_key, payload)
 
-        self.connect_to_broker("")  # Placeholder for connection logic
+    def set_callbacks(self):
+        self.mqttTopicCallbacks = {}
 
-    def connect_to_broker(self, instance):
-        # Logic for connecting to the MQTT broker
-        print("Connecting to the broker...")
+        # MQTT -> mailbox -> state store, on the UI thread
+        history_recorders = {}
+        if self.history_store:
+            history_recorders = {
+                "RELAYS": self.history_store.record_relays,
+                "SENSORS": self.history_store.record_sensors,
+            }
+        for topic_key, apply in self.store_appliers().items():
+            recorders = []
+            if topic_key in history_recorders:
+                recorders.append(history_recorders[topic_key])
+            if topic_key in SNAPSHOT_TOPIC_KEYS:
+                recorders.append(self.snapshot_recorder(topic_key))
+            self.add_cb(topic_key, apply, recorders=recorders)
+        self.add_cb("CMD_RESPONSE", self.on_cmd_response, keep_all=True)
+        self.mqtt_client.setTopicsCallback(self.mqttTopicCallbacks)
+        self.store.subscribe(StateStore.STALE, lambda stale: self.update_title())
 
-    def toggle_hd(self):
-        # Logic for toggling relay states
-        print("Toggling relay state...")
+    # Screens are built the first time they are shown. Each view subscribes to
+    # the fields it renders then, and gets the current state right away.
+    def build_mqtt_screen(self, screen, gate):
+        from MqttSettingsWidget import MQTTSettingsWidget
 
-    # @mainthread
-    def update_status(self, status, color):
-        self.connection_status = status
-        self.status_label.text = status
-        self.status_label.color = (0, 1, 0, 1) if color == "green" else (1, 0, 0, 1)
+        self.mqttSettingsWidget = MQTTSettingsWidget()
+        self.mqttSettingsWidget.add_cb(self.mqtt_client.connect_to_server)
+        self.mqtt_client.status_callback = self.mqttSettingsWidget.update_status
+        screen.add_widget(self.mqttSettingsWidget)
+        self.store.subscribe(StateStore.LOCAL_TIME, gate.wrap(self.mqttSettingsWidget.update_local_time_hd))
 
+    def on_cmd_response(self, payload):
+        print(payload)
+        # Not gated, a running import waits for these even while its screen is hidden
+        if "commands" in self.built_screens:
+            self.commandWidget.on_cmd_response(payload)
 
-class MainApp(MDApp):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.mqtt_client = MQTTClient(self.on_connect)
+    def build_commands_screen(self, screen, gate):
+        from CommandWidget import CommandWidget
 
-    def on_connect(self, client, userdata, flags, rc):     
-        self.mqttSettingsWidget.on_connect(client, userdata, flags, rc)
+        self.commandWidget = CommandWidget(self.mqtt_client.commandManager)
+        screen.add_widget(self.commandWidget)
+        self.store.subscribe(StateStore.CMD_OPTIONS, gate.wrap(self.commandWidget.rebuild_cmd_options))
+        self.store.subscribe(StateStore.CMD_LIST, gate.wrap(self.commandWidget.rebuild_cmd_list))
 
-    def add_cb(self, topic_key, callback, call_on_main_thread=True):
-        if False == call_on_main_thread:
-            self.mqttTopicCallbacks[self.mqtt_client.SUB_TOPICS[topic_key]] = callback
-            return
-        self.mqttTopicCallbacks[self.mqtt_client.SUB_TOPICS[topic_key]] = lambda payload: Clock.schedule_once(lambda dt: callback(payload))
+    def build_relay_screen(self, screen, gate):
+        from RelayStatesWidget import RelayStatesWidget
 
-    def set_callbacks(self):
-        self.mqttTopicCallbacks = {}
+        self.relayStateWidget = RelayStatesWidget(self.toggle_hd, self.store.relay_state)
+        screen.add_widget(self.relayStateWidget)
+        self.store.subscribe(StateStore.RELAYS, gate.wrap(
+            self.relayStateWidget.build_or_update, key=lambda record: record.relay))
 
-        sub_top = self.mqtt_client.SUB_TOPICS
-        self.mqttTopicCallbacks[self.mqtt_client.SUB_TOPICS["LOCAL_TIME"]] = self.mqttSettingsWidget.update_local_time_hd
-        self.add_cb("CMD_OPTIONS", self.commandWidget.rebuild_cmd_options)
-        self.add_cb("RELAYS", self.relayStateWidget.build_or_update)
-        self.add_cb("CMD_LIST", self.commandWidget.rebuild_cmd_list, False)
-        self.add_cb("CMD_RESPONSE", lambda payload: print(payload))
-        self.add_cb("SENSORS", self.sensorsStateWidget.update_data)
-        self.mqtt_client.setTopicsCallback(self.mqttTopicCallbacks)
+    def build_sensors_screen(self, screen, gate):
+        from kivymd.uix.scrollview import MDScrollView
+        from SensorWidget import SensorWidget
+
+        sensors_scroll_view = MDScrollView()
+        self.sensorsStateWidget = SensorWidget(self.store.sensor_history)
+        sensors_scroll_view.add_widget(self.sensorsStateWidget)
+        screen.add_widget(sensors_scroll_view)
+        self.store.subscribe(StateStore.SENSORS, gate.wrap(
+            self.sensorsStateWidget.update_data, key=lambda sample: sample[0].key))
+
+    def build_schedule_screen(self, screen, gate):
+        from SchedulePreviewWidget import SchedulePreviewWidget
+
+        self.schedulePreviewWidget = SchedulePreviewWidget()
+        screen.add_widget(self.schedulePreviewWidget)
+        # Sensor driven commands follow the sensors, at most once a second
+        self.schedule_trigger = Clock.create_trigger(self.refresh_schedule_preview, 1.0)
+        for field in (StateStore.CMD_OPTIONS, StateStore.CMD_LIST, StateStore.SENSORS):
+            self.store.subscribe(field, gate.wrap(lambda value: self.schedule_trigger()), replay=False)
+        self.refresh_schedule_preview()
+
+    def refresh_schedule_preview(self, *args):
+        from CommandGrammar import CommandSyntaxError, compile_grammar
+
+        if self.store.cmd_list is None:
+            return
+        options = self.store.cmd_options
+        grammar = None
+        relays = sorted(self.store.relays)
+        if options:
+            try:
+                grammar = compile_grammar(options)
+            except CommandSyntaxError:
+                pass
+            relays = [relay for relay in options.get("RelayIds", relays) if relay != "RXX"]
+        self.schedulePreviewWidget.update(self.store.cmd_list.commands, relays, self.store.sensors, grammar)
+
+    def ensure_screen_built(self, name):
+        if name in self.built_screens or name not in self.screen_builders:
+            return
+        self.built_screens.add(name)
+        self.screen_builders[name](self.screen_manager.get_screen(name), self.screen_gates[name])
+        startup_profiler.mark(f"{name} screen built")
+
+    def on_screen_changed(self, screen_manager, current):
+        for name, gate in self.screen_gates.items():
+            if name != current:
+                gate.hide()
+        self.ensure_screen_built(current)
+        if current in self.screen_gates:
+            self.screen_gates[current].show()
+        self.update_title()
+
+    def update_title(self):
+        if not hasattr(self, "top_app_bar"):
+            return
+        current = self.screen_manager.current
+        cached = [f for f in SCREEN_FIELDS.get(current, ()) if f in self.store.stale]
+        if cached:
+            self.top_app_bar.title = f"{APP_TITLE} (cached {', '.join(cached)}, waiting for controller)"
+        else:
+            self.top_app_bar.title = APP_TITLE
 
     def toggle_hd(self, relay, state):
         # remove old command if exists
         priority = "PTX" if relay == "RXX" else "PTO"
 
         current_command = f"Manua;{relay};{state};{priority};"
+        if self.store.cmd_options:
+            from CommandGrammar import CommandSyntaxError, compile_grammar
+
+            try:
+                compile_grammar(self.store.cmd_options).parse(current_command)
+            except CommandSyntaxError as e:
+                print(f"Not sending override {current_command}: {e}")
+                return
         self.mqtt_client.overrideCommand(current_command)
         print(f"Toggle {relay} {state}")
 
@@ -140,6 +311,11 @@ class MainApp(MDApp):
         button4.bind(on_release=self.on_sensor_button_click)
         drawer_list.add_widget(button4)
 
+        button5 = OneLineIconListItem(text="Schedule Preview")
+        button5.add_widget(IconLeftWidget(icon="calendar-clock"))
+        button5.bind(on_release=self.on_schedule_button_click)
+        drawer_list.add_widget(button5)
+
         # Add the drawer content (list of buttons)
         nav_drawer.add_widget(drawer_content)
         drawer_content.add_widget(drawer_list)
@@ -147,35 +323,21 @@ class MainApp(MDApp):
         # Create the Screen Manager (Main content area)
         self.screen_manager = MDScreenManager(transition=NoTransition())
 
-        # Add screens
-        mqtt_screen = MDScreen(name="mqtt")
-        self.mqttSettingsWidget = MQTTSettingsWidget()
-        self.mqttSettingsWidget.add_cb(self.mqtt_client.connect_to_server)
-        mqtt_screen.add_widget(self.mqttSettingsWidget)
-        self.screen_manager.add_widget(mqtt_screen)
-
-        commands_screen = MDScreen(name="commands")
-        self.commandWidget = CommandWidget(self.mqtt_client.commandManager)
-        commands_screen.add_widget(self.commandWidget)
-        self.screen_manager.add_widget(commands_screen)
-
-        relay_screen = MDScreen(name="relay")
-        relay_scroll_view = MDScrollView()
-        self.relayStateWidget = RelayStatesWidget(self.toggle_hd)
-        relay_scroll_view.add_widget(self.relayStateWidget)
-        relay_screen.add_widget(relay_scroll_view)
-        self.screen_manager.add_widget(relay_screen)
-
-        sensors_screen = MDScreen(name="sensors")
-        sensors_scroll_view = MDScrollView()
-        self.sensorsStateWidget = SensorWidget()
-        sensors_scroll_view.add_widget(self.sensorsStateWidget)
-        sensors_screen.add_widget(sensors_scroll_view)
-        self.screen_manager.add_widget(sensors_screen)
+        # Add empty screens, their content is built when first shown
+        self.screen_builders = {
+            "mqtt": self.build_mqtt_screen,
+            "commands": self.build_commands_screen,
+            "relay": self.build_relay_screen,
+            "sensors": self.build_sensors_screen,
+            "schedule": self.build_schedule_screen,
+        }
+        self.built_screens = set()
+        for name in SCREEN_NAMES:
+            self.screen_manager.add_widget(MDScreen(name=name))
 
         # Add the top app bar
-        top_app_bar = MDTopAppBar(
-            title="Irrigation System",
+        self.top_app_bar = top_app_bar = MDTopAppBar(
+            title=APP_TITLE,
             left_action_items=[["menu", lambda x: nav_drawer.set_state("toggle")]]
         )
 
@@ -187,9 +349,21 @@ class MainApp(MDApp):
         nav_layout.add_widget(nav_drawer)
 
         self.set_callbacks()
+        self.screen_manager.bind(current=self.on_screen_changed)
+        self.on_screen_changed(self.screen_manager, self.screen_manager.current)
+
+        if os.environ.get(REPLAY_PATH_ENV):
+            speed = float(os.environ.get(REPLAY_SPEED_ENV, "1"))
+            self.mqtt_client.start_replay(os.environ[REPLAY_PATH_ENV], speed)
 
+        startup_profiler.mark("build done")
         return layout
 
+    def on_start(self):
+        from kivy.core.window import Window
+
+        startup_profiler.watch_first_frame(Window)
+
     def on_mqtt_button_click(self, instance):
         self.screen_manager.current = "mqtt"
 
@@ -202,9 +376,36 @@ class MainApp(MDApp):
     def on_sensor_button_click(self, instance):
         self.screen_manager.current = "sensors"
 
+    def on_schedule_button_click(self, instance):
+        self.screen_manager.current = "schedule"
+
+    def on_stop(self):
+        for topic, stats in self.mailbox.stats().items():
+            print(f"{topic}: delivered {stats['delivered']}, dropped {stats['dropped']}")
+        print(f"Payload decoding ({self.mqtt_client.decoder.backend}): {self.mqtt_client.decoder.stats()}")
+        print(f"Publish queue: {self.mqtt_client.publish_stats()}")
+        print(f"Hidden screen updates: { {name: gate.stats() for name, gate in self.screen_gates.items()} }")
+        if "relay" in self.built_screens:
+            print(f"Relay label updates: {self.relayStateWidget.update_stats()}")
+        if "sensors" in self.built_screens:
+            print(f"Sensor label updates: {self.sensorsStateWidget.update_stats()}")
+        self.mqtt_client.stop_replay()
+        self.mqtt_client.stop_capture()
+        self.mqtt_client.disconnect_from_server()
+        if self.local_controller:
+            self.local_controller.stop()
+        if self.history_store:
+            self.history_store.close()
+        self.snapshot_cache.close()
+
 
 if __name__ == "__main__":
-    MainApp().run()
+    if os.environ.get(MQTT_TRANSPORT_ENV) == "asyncio":
+        import asyncio
+
+        asyncio.run(MainApp().async_run(async_lib="asyncio"))
+    else:
+        MainApp().run()
 
 # class MQTTApp(MDApp):
 #     connection_status = StringProperty("Not connected")
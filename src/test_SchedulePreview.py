@@ -0,0 +1,25 @@
+import SchedulePreview
+from SchedulePreview import preview_schedule
+
+
+def resolve(commands, relays, use_numpy):
+    np = SchedulePreview.np
+    if not use_numpy:
+        SchedulePreview.np = None
+    try:
+        preview = preview_schedule(commands, relays)
+        return {relay: [(start, end, state) for start, end, state, _ in preview.segments(relay)]
+                for relay in relays}
+    finally:
+        SchedulePreview.np = np
+
+
+def test_toggle_all_beats_relay_override():
+    # "Toggle all" (RXX, PTX) supersedes per relay overrides (PTO), in either order
+    for commands in (["Manua;R01;Opened;PTO;", "Manua;RXX;Closed;PTX;"],
+                     ["Manua;RXX;Closed;PTX;", "Manua;R01;Opened;PTO;"]):
+        for use_numpy in (True, False):
+            assert resolve(commands, ["R01", "R02"], use_numpy) == {
+                "R01": [(0, 1440, 0)],
+                "R02": [(0, 1440, 0)],
+            }